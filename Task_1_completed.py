@@ -1,7 +1,21 @@
 import pandas as pd
-import json
+import numpy as np
+import math
+import os
 
-from rapidfuzz import fuzz, process
+import bisect
+import collections
+import concurrent.futures
+import functools
+
+from rapidfuzz import fuzz, process, utils
+
+import drug_dictionary
+from aho_corasick import build_automaton, find_all
+from tfidf_matcher import build_tfidf, vectorize, top_k
+from match_cache import get_fingerprint, open_cache, get_matches, put_matches
+from outputs import get_output_file, write_jsonl, write_output
+from instrumentation import counters, measure, write_metrics
 
 """
 I start by importing and cleaning/transforming the files.
@@ -14,20 +28,60 @@ I create a list with all the names, using the vertical line as a delimiter.
 
 I assume we are only interested in the trials whose intervention_type is "Drug",
 so I create a dataframe considering just them.
+
+When STREAMING is set to True, the clinical trials file is not loaded at 
+once. It is read in chunks of CHUNK_SIZE records instead (see match_stream()).
+When USE_DICTIONARY is set to True, the cleaned names are read from the file 
+compiled by drug_dictionary.py instead of drugs.csv.
+
+The loading is done at the end of the script, so that the functions below can
+also be imported by pipeline.py and run on dataframes that are already in 
+memory.
 """
 
-drugs = pd.read_csv('drugs.csv')
-clinical_trials = pd.read_json('clinical_trials_2015.jsonl', lines = True) 
+STREAMING = False
+CHUNK_SIZE = 10000
+USE_DICTIONARY = False
+
+def select_drug_interventions(clinical_trials):
+    """
+    Removes the trademark symbols from a clinical trials dataframe and keeps 
+    only the trials whose intervention_type is "Drug".
+
+    Parameters
+    ----------
+    clinical_trials : Clinical trials dataframe (or chunk of it).
+
+    Returns
+    -------
+    clinical_trials_drug_intervention : Filtered dataframe without the 
+                                        intervention_type column.
+    """
+    clinical_trials = clinical_trials.replace({'®':'','™':''},regex=True)
+    clinical_trials_drug_intervention = clinical_trials.loc[
+        clinical_trials['intervention_type'] == 'Drug'].reset_index(drop = True)
+    clinical_trials_drug_intervention.drop(['intervention_type'], 
+                                           axis = 1, inplace = True)
+    return clinical_trials_drug_intervention
+
+def get_drug_names(drugs):
+    """
+    Removes the trademark symbols from the drugs dataframe and lists all the 
+    names of each drug.
 
-drugs = drugs.replace({'®':'','™':''},regex=True)
-drugs['All names'] = drugs.iloc[:,0] + '|' + drugs.iloc[:,1]
-drugs_names = drugs['All names'].str.split('|', expand = False).to_frame()
+    Parameters
+    ----------
+    drugs : Drugs dataframe (primary name and alternate names columns).
 
-clinical_trials = clinical_trials.replace({'®':'','™':''},regex=True)
-clinical_trials_drug_intervention = clinical_trials.loc[
-    clinical_trials['intervention_type'] == 'Drug'].reset_index(drop = True)
-clinical_trials_drug_intervention.drop(['intervention_type'], 
-                                       axis = 1, inplace = True)
+    Returns
+    -------
+    list
+        List with the names of each drug, with the primary name first.
+    """
+    drugs = drugs.replace({'®':'','™':''},regex=True)
+    drugs['All names'] = drugs.iloc[:,0] + '|' + drugs.iloc[:,1]
+    drugs_names = drugs['All names'].str.split('|', expand = False).to_frame()
+    return drugs_names.iloc[:,0].tolist()
 
 """
 For the matching task, I used fuzzy string matching. However, to 
@@ -43,6 +97,38 @@ e.g., "labetalol (seizure prevention)" is split into the list
 compared against intervention_name substrings of equal word count.  
 """
 
+SCORE_THRESHOLD = 97.5
+GRAM_SIZE = 3
+
+# 'index' scores each intervention_name against its candidate drugs, 'batch'
+# scores all windows against all names at once with process.cdist, 'tfidf'
+# finds candidate names by TF-IDF similarity (see match_tfidf()).
+MATCHING_MODE = 'index'
+BATCH_SIZE = 2000
+
+# 'tfidf' mode: number of candidate names per intervention_name, minimum
+# cosine similarity of a candidate, scorer used to re-rank the candidates
+# ('WRatio', 'partial_ratio' or None to keep the similarity) and the score
+# (or similarity, without re-ranking) a candidate needs to match.
+TOP_K = 10
+MIN_SIMILARITY = 0.2
+RERANK = 'WRatio'
+RERANK_THRESHOLD = 90
+SIMILARITY_THRESHOLD = 0.8
+
+# Matches are kept in an on-disk cache (see match_cache.py) so reruns only 
+# match the intervention_names that have not been seen with this dictionary.
+USE_CACHE = True
+
+# Skip the windows that share too few characters with the drug name to reach 
+# SCORE_THRESHOLD (see prune_windows()).
+CHAR_PRUNING = False
+
+# With more than one worker, the intervention_names are matched in shards of 
+# SHARD_SIZE by a pool of WORKERS processes (None uses every CPU core).
+WORKERS = 1
+SHARD_SIZE = 500
+
 def get_substrings(string, spaces):
     """
     Splits a string into its constituent substrings with a set number
@@ -67,19 +153,165 @@ def get_substrings(string, spaces):
         start += 1
     return substrings
 
-def find_match(drug_name, notes):
+def get_windows(notes, spaces):
+    """
+    Splits an intervention_name into the substrings a drug name with the given
+    number of spaces is compared against.
+
+    Parameters
+    ----------
+    notes : intervention_name string.
+    spaces : Number of spaces in the drug name.
+
+    Returns
+    -------
+    list
+        List of substrings of the intervention_name.
+    """
+    if spaces == 0:
+        return notes.split(' ')
+    return get_substrings(notes, spaces)
+
+"""
+QRatio scores two processed strings as 200 * LCS / (len1 + len2), and the 
+longest common subsequence can neither be longer than the shorter string nor 
+use more copies of a character than either string has. So before scoring, the
+windows are sorted (bucketed) by processed length, and only the ones whose 
+length is within the range that can reach SCORE_THRESHOLD against the drug 
+name's length are taken (with a binary search). If CHAR_PRUNING is True, the 
+windows that share too few characters with the drug name (as multisets) are 
+skipped too. Only the windows left are scored, so the result does not change. 
+counters records how many windows were scored and pruned by each bound.
+
+The character bound is off by default: counting the characters in Python 
+takes longer than rapidfuzz takes to score the few windows that survive the 
+length bound, so it only pays off with very long intervention_names.
+
+find_match() is called with the same intervention_name for every candidate 
+alias, and the windows only depend on the number of words of the alias. So 
+instead of splitting and processing the intervention_name again for every 
+alias, its processed windows are built once per word count and kept in a 
+window table (a dictionary keyed by the number of spaces), which 
+match_notes() shares between exact_matches() and all the find_match() calls 
+of the intervention_name. Aliases with the same word count all use the same 
+entry of the table. The profile of every drug name is cached as well.
+"""
+
+def can_reach_threshold(shared, length_1, length_2):
+    """
+    Checks if a QRatio score with a given upper bound of the LCS can be above 
+    SCORE_THRESHOLD (with some margin for the floating point rounding).
+
+    Parameters
+    ----------
+    shared : Upper bound of the longest common subsequence.
+    length_1, length_2 : Lengths of the processed strings.
+
+    Returns
+    -------
+    bool
+        False if the score cannot be above SCORE_THRESHOLD.
+    """
+    return 200 * shared > (SCORE_THRESHOLD - 1e-6) * (length_1 + length_2)
+
+@functools.lru_cache(maxsize = None)
+def get_drug_profile(drug_name):
+    """
+    Processes a drug name and computes what prune_windows() needs from it.
+
+    Parameters
+    ----------
+    drug_name : Drug name string.
+
+    Returns
+    -------
+    processed : Processed drug name.
+    low, high : Shortest and longest processed window lengths that can score 
+                above SCORE_THRESHOLD against it.
+    chars : List of (character, count) tuples of the processed drug name.
+    """
+    processed = utils.default_process(drug_name)
+    length = len(processed)
+    lengths = [x for x in range(2 * length + 2) 
+               if can_reach_threshold(min(length, x), length, x)]
+    low, high = (lengths[0], lengths[-1]) if lengths else (1, 0)
+    chars = [(x, processed.count(x)) for x in set(processed)]
+    return processed, low, high, chars
+
+def get_table_windows(table, notes, spaces):
+    """
+    Gets the processed windows of an intervention_name for a number of spaces
+    from its window table, building them the first time they are needed.
+
+    Parameters
+    ----------
+    table : Window table of the intervention_name (dictionary), updated in 
+            place.
+    notes : intervention_name string.
+    spaces : Number of spaces in the drug name.
+
+    Returns
+    -------
+    lengths : Sorted list of the lengths of the processed windows.
+    windows : Processed windows, sorted by length.
+    """
+    if spaces not in table:
+        windows = sorted((utils.default_process(x) for x in 
+                          get_windows(notes, spaces)), key = len)
+        table[spaces] = ([len(x) for x in windows], windows)
+    return table[spaces]
+
+def prune_windows(profile, buckets):
+    """
+    Drops the windows of an intervention_name that cannot score above 
+    SCORE_THRESHOLD against a drug name.
+
+    Parameters
+    ----------
+    profile : Output of get_drug_profile().
+    buckets : Output of get_table_windows().
+
+    Returns
+    -------
+    list
+        Processed windows that could still match.
+    """
+    processed, low, high, chars = profile
+    lengths, windows = buckets
+    start = bisect.bisect_left(lengths, low)
+    end = bisect.bisect_right(lengths, high)
+    if start >= end:
+        counters['windows pruned by length'] += len(windows)
+        return []
+    
+    kept = windows[start:end]
+    if CHAR_PRUNING:
+        kept = [x for x in kept if can_reach_threshold(
+            sum(min(n, x.count(char)) for char, n in chars), 
+            len(processed), len(x))]
+    counters['windows pruned by length'] += len(windows) - (end - start)
+    counters['windows pruned by characters'] += end - start - len(kept)
+    counters['windows scored'] += len(kept)
+    return kept
+
+def find_match(drug_name, notes, table = None):
     """
     Takes a drug name and an intervention_name strings, splits the 
     intervention_name into substrings of equal word count to the drug (by 
     calling .split() method or the get_substrings() function), and 
     performs fuzzy matching using the quick ratio function of the rapidfuzz 
     library. The commented lines are there in case another scorer is used. Since
-    Qratio is case insensitive, they are not needed in this implementation.
+    the strings are passed through utils.default_process, they are not needed 
+    in this implementation (newer rapidfuzz versions no longer apply it by 
+    default, so it is done explicitly, before the windows that cannot reach 
+    the threshold are pruned).
 
     Parameters
     ----------
     drug_name : Drug name string.
     notes : intervention_name string.
+    table : Window table of the intervention_name (see get_table_windows()),
+            or None to build the windows for this call only.
 
     Returns
     -------
@@ -87,6 +319,7 @@ def find_match(drug_name, notes):
         TRUE if the quick ratio score is above the 97.5 threshold.
         FALSE otherwise.
     """
+    counters['find_match calls'] += 1
     spaces = drug_name.count(' ')
     length = len(drug_name)
     if (length<=2) | (spaces>(notes.count(' '))) | (length>len(notes)) :
@@ -94,14 +327,17 @@ def find_match(drug_name, notes):
     else:
         #drug_name = drug_name.lower()
         #notes = notes.lower()
-        if spaces == 0:
-            words_in_notes = notes.split(' ')
-        else:
-            words_in_notes = get_substrings(notes, spaces)
+        profile = get_drug_profile(drug_name)
+        if table is None:
+            table = {}
+        words_in_notes = prune_windows(profile, get_table_windows(
+            table, notes, spaces))
         if words_in_notes:
-            best_match = process.extractOne(drug_name, words_in_notes, 
-                                            scorer = fuzz.QRatio)
-            if best_match[1] > 97.5:
+            counters['extractOne calls'] += 1
+            best_match = process.extractOne(profile[0], words_in_notes, 
+                                            scorer = fuzz.QRatio,
+                                            processor = None)
+            if best_match[1] > SCORE_THRESHOLD:
                 return True
             else:
                 pass
@@ -110,57 +346,801 @@ def find_match(drug_name, notes):
 
 
 """
-In the following code, the first loop visit all rows in the intervention_name 
-column of the clinical_trials_drug_intervention dataframe. The second loop 
-visits all rows in the drugs_names dataframe. 
+Comparing every intervention_name against every alias of every drug is what 
+makes this script slow. However, a QRatio above 97.5 leaves very little room
+for differences: the score is 200 * LCS / (len1 + len2), so an alias shorter 
+than 20 characters needs an identical window, and longer aliases can only 
+afford one or two inserted/deleted characters.
+
+I use this to build an inverted index from the character trigrams of every 
+(processed) alias to the aliases containing them. Every edit destroys at most 
+three trigrams of the alias, so an alias can only clear the threshold against 
+an intervention_name that shares at least len(trigrams) - 3 * max_edits of 
+its trigrams. The intervention_name is then only scored against the drugs 
+that have a candidate alias, with the same find_match() function as before, 
+so the output does not change. Aliases too short to be indexed this way are 
+kept as candidates for every intervention_name.
+"""
+
+def get_grams(string, size = GRAM_SIZE):
+    """
+    Returns the set of character n-grams of a string.
+
+    Parameters
+    ----------
+    string : Input string.
+    size : Length of the n-grams.
+
+    Returns
+    -------
+    set
+        Set of n-grams (empty if the string is shorter than size).
+    """
+    return {string[i:i+size] for i in range(len(string) - size + 1)}
+
+def max_edits(length):
+    """
+    Computes the largest number of inserted/deleted characters between a 
+    processed drug name of the given length and a window of the 
+    intervention_name that can still score above SCORE_THRESHOLD with QRatio.
+    The window can be at most max_edits longer than the drug name, hence the 
+    bound k < 2 * c * length / (1 - c), where c is the allowed fraction. 
+
+    Parameters
+    ----------
+    length : Length of the processed drug name.
+
+    Returns
+    -------
+    int
+        Maximum number of edits (rounded up slightly to stay on the safe side).
+    """
+    c = (100 - SCORE_THRESHOLD) / 100
+    return math.ceil(2 * c * length / (1 - c) + 1e-9) - 1
+
+def build_gram_index(drugs_names, fuzzy_only = False):
+    """
+    Builds the trigram inverted index over all the names of all drugs. 
+
+    Parameters
+    ----------
+    drugs_names : Iterable of name lists, with the primary name first.
+    fuzzy_only : If True, only the names long enough to match a window that 
+                 is not identical to them are indexed.
+
+    Returns
+    -------
+    index : Dictionary mapping each trigram to the ids of the aliases 
+            containing it.
+    aliases : List of (drug row, alias) tuples, positioned by alias id.
+    required : List with the minimum number of shared trigrams per alias id.
+    always : List of alias ids that are candidates for every intervention.
+    """
+    index = collections.defaultdict(list)
+    aliases = []
+    required = []
+    always = []
+    for drug_idx, names in enumerate(drugs_names):
+        for name in names:
+            processed = utils.default_process(name)
+            # find_match() never matches these, so they are left out
+            if (len(name)<=2) | (not processed):
+                continue
+            if fuzzy_only and max_edits(len(processed)) < 1:
+                continue
+            alias_id = len(aliases)
+            aliases.append((drug_idx, name))
+            grams = get_grams(processed)
+            required.append(len(grams) - max_edits(len(processed))*GRAM_SIZE)
+            if required[alias_id] <= 0:
+                always.append(alias_id)
+            else:
+                for gram in grams:
+                    index[gram].append(alias_id)
+    return index, aliases, required, always
+
+def candidate_drugs(notes, index, aliases, required, always):
+    """
+    Looks up the drugs that could match an intervention_name. The trigrams 
+    are taken from the processed intervention_name both as is and with its 
+    whitespace collapsed, since those are the two ways find_match() builds 
+    its windows.
+
+    Parameters
+    ----------
+    notes : intervention_name string.
+    index, aliases, required, always : Output of build_gram_index().
+
+    Returns
+    -------
+    list
+        (drug row, candidate aliases) tuples, sorted by drug row.
+    """
+    grams = get_grams(utils.default_process(notes)) | get_grams(
+        utils.default_process(' '.join(notes.split())))
+    counts = collections.Counter()
+    for gram in grams:
+        counts.update(index.get(gram, ()))
+    candidates = collections.defaultdict(list)
+    for alias_id, count in counts.items():
+        if count >= required[alias_id]:
+            drug_idx, name = aliases[alias_id]
+            candidates[drug_idx].append(name)
+    for alias_id in always:
+        drug_idx, name = aliases[alias_id]
+        candidates[drug_idx].append(name)
+    kept = sum(len(x) for x in candidates.values())
+    counters['candidates kept'] += kept
+    counters['candidates pruned'] += len(aliases) - kept
+    return sorted(candidates.items())
+
+"""
+Since a drug name shorter than 20 characters can only clear the threshold 
+against an identical (processed) window, most matches are exact. These are 
+found first with an Aho-Corasick automaton built over the processed names of 
+all drugs, which finds every occurrence of every name in the processed 
+intervention_name in a single pass. An occurrence only counts if it is an 
+actual window of the intervention_name, as built by find_match(), and passes 
+the same length and space checks.
+
+The fuzzy find_match() path then only needs to run for the names that can 
+match a window with some edits, i.e. the ones kept by 
+build_gram_index(fuzzy_only = True), and only for drugs that had no exact hit.
+counters (see instrumentation.py) records how many drug matches came from 
+each path.
+"""
+
+def build_exact_index(drugs_names):
+    """
+    Builds the automaton over the processed names of all drugs.
+
+    Parameters
+    ----------
+    drugs_names : Iterable of name lists, with the primary name first.
+
+    Returns
+    -------
+    automaton : Output of build_automaton() over the distinct processed names.
+    entries : List with the (drug row, length, spaces) tuples of the original 
+              names behind each processed name, positioned by pattern id.
+    """
+    patterns = {}
+    entries = []
+    for drug_idx, names in enumerate(drugs_names):
+        for name in names:
+            processed = utils.default_process(name)
+            if (len(name)<=2) | (not processed):
+                continue
+            if processed not in patterns:
+                patterns[processed] = len(entries)
+                entries.append([])
+            entries[patterns[processed]].append(
+                (drug_idx, len(name), name.count(' ')))
+    return build_automaton(list(patterns)), entries
+
+def exact_matches(notes, automaton, entries, table = None):
+    """
+    Finds the drugs with a name identical to a window of an intervention_name
+    (after processing), i.e. the drugs for which find_match() would return a 
+    perfect score.
+
+    Parameters
+    ----------
+    notes : intervention_name string.
+    automaton, entries : Output of build_exact_index().
+    table : Window table of the intervention_name (see get_table_windows()).
+
+    Returns
+    -------
+    set
+        Rows of the matched drugs.
+    """
+    found = set()
+    table = {} if table is None else table
+    texts = {utils.default_process(notes), 
+             utils.default_process(' '.join(notes.split()))}
+    for text in texts:
+        for start, pattern_id in find_all(automaton, text):
+            end = start + automaton[3][pattern_id]
+            # windows are always delimited by spaces once processed
+            if (start and text[start-1] != ' ') | (
+                    end < len(text) and text[end] != ' '):
+                continue
+            for drug_idx, length, spaces in entries[pattern_id]:
+                if (drug_idx in found) | (spaces>notes.count(' ')) | (
+                        length>len(notes)):
+                    continue
+                lengths, windows = get_table_windows(table, notes, spaces)
+                if text[start:end] in windows[
+                        bisect.bisect_left(lengths, end - start):
+                        bisect.bisect_right(lengths, end - start)]:
+                    found.add(drug_idx)
+    return found
+
+"""
+Alternatively, the matching can be done in batch. Instead of calling 
+find_match() once per alias and intervention_name, all the windows of all 
+the intervention_names are built once per word count and scored against all 
+the names with the same number of spaces in a single process.cdist() call, 
+which runs in C across all cores. The windows are scored in blocks of 
+BATCH_SIZE to keep the score matrix in memory. The checks find_match() does 
+before scoring are applied to the few pairs above the threshold.
+
+In a process pool, every worker groups the names once when it starts and 
+runs process.cdist() on a single thread, since the pool already keeps every 
+core busy.
+"""
+
+def group_names(drugs_names):
+    """
+    Groups the processed names of all drugs by their number of spaces.
+
+    Parameters
+    ----------
+    drugs_names : Iterable of name lists, with the primary name first.
+
+    Returns
+    -------
+    by_spaces : Dictionary with the (drug row, name length, processed name) 
+                tuples of the names with each number of spaces.
+    """
+    by_spaces = collections.defaultdict(list)
+    for drug_idx, names in enumerate(drugs_names):
+        for name in names:
+            processed = utils.default_process(name)
+            if (len(name)<=2) | (not processed):
+                continue
+            by_spaces[name.count(' ')].append((drug_idx, len(name), processed))
+    return by_spaces
+
+def match_batch(interventions, drugs_names, by_spaces = None, workers = -1):
+    """
+    Matches all intervention_names against all drug names with 
+    process.cdist() and reduces the score matrix to per-trial drug lists. 
+
+    Parameters
+    ----------
+    interventions : List of intervention_name strings.
+    drugs_names : Iterable of name lists, with the primary name first.
+    by_spaces : Output of group_names(), or None to build it.
+    workers : Number of threads of process.cdist() (-1 uses every CPU core).
+
+    Returns
+    -------
+    matches : List with the matched primary names of each intervention_name,
+              in the same order as find_match() would produce them.
+    """
+    interventions = list(interventions)
+    drugs_names = list(drugs_names)
+    if by_spaces is None:
+        by_spaces = group_names(drugs_names)
+    
+    matched = [set() for notes in interventions]
+    for spaces, names in by_spaces.items():
+        windows = []
+        owners = []
+        for notes_idx, notes in enumerate(interventions):
+            if spaces>notes.count(' '):
+                continue
+            words_in_notes = get_windows(notes, spaces)
+            windows.extend(utils.default_process(x) for x in words_in_notes)
+            owners.extend([notes_idx]*len(words_in_notes))
+        
+        for start in range(0, len(windows), BATCH_SIZE):
+            scores = process.cdist([x[2] for x in names], 
+                                   windows[start:start+BATCH_SIZE],
+                                   scorer = fuzz.QRatio, 
+                                   score_cutoff = SCORE_THRESHOLD,
+                                   dtype = np.float64, workers = workers)
+            for name_idx, window_idx in zip(*np.nonzero(scores>SCORE_THRESHOLD)):
+                drug_idx, length, processed = names[name_idx]
+                notes_idx = owners[start+window_idx]
+                if length<=len(interventions[notes_idx]):
+                    matched[notes_idx].add(drug_idx)
+    
+    return [[drugs_names[i][0] for i in sorted(x)] for x in matched]
+
+"""
+In the following code, every distinct intervention_name is matched once: the 
+same drug is often listed under several arms, and some nct_ids are repeated 
+with the same intervention_name (e.g. NCT01003028), so there is no need to 
+match them again. The strings are compared after the trademark symbols have 
+been removed. Any further normalisation (case, whitespace) would change the 
+windows and length checks of find_match(), so it is not applied here.
 
+For each distinct intervention_name, the code finds the exact matches with the
+automaton and looks up the remaining candidate drugs in the index. 
 Subsequently, the code applies the find_match() function between the 
-intervention_name string and all the names registered for a drug. If a match 
-is found, then the primary name is appended to a list containing all the 
-recorded matches for that clinical trial.
+intervention_name string and the candidate names of each remaining drug. The 
+primary names of all matched drugs are put in a list containing all the 
+recorded matches for that intervention_name.
+
+These lists are then fanned back out to the matches list containing all the 
+matches for all clinical trials. counters also keeps the number of 
+intervention_names seen and how many of them were distinct.
 
-This list is then appended to the matches list containing all the matches for all 
-clinical trials.
+When USE_CACHE is True, the distinct intervention_names are first looked up 
+in the on-disk cache, and only the missing ones are matched and added to it. 
+The cache entries are stored under a fingerprint of the drug names, the scorer
+and the threshold, so changing any of them (e.g. a new alias in drugs.csv) 
+makes every intervention_name be matched again.
 
 """
-matches = []
 
-for w in clinical_trials_drug_intervention.iloc[:,1]:
-    matches_to_notes = []
-    for i in drugs_names.iloc[:,0]:
-        drug_matches = list(filter(lambda x: find_match(x, w), i))
-        if drug_matches: 
-            matches_to_notes.append(i[0])
-    matches.append(matches_to_notes)
- 
 """
-The matches list is appended to the nct_id column from the 
-clinical_trials_drug_intervention dataframe. All clinical trials without a 
-match are dropped from the final file.
-"""  
- 
-result = clinical_trials_drug_intervention.copy()
-result['drugs'] = matches
-result.drop(['intervention_name'], axis = 1, inplace = True)
-result = result[result['drugs'].map(lambda x: len(x)) > 0]
+The notes at the end of this script mention that WRatio matches drug names 
+much better than QRatio, without splitting the intervention_name into 
+windows, but scoring every intervention_name against every name with it is 
+far too slow. The 'tfidf' mode makes it affordable: all the names and 
+intervention_names are turned into character trigram TF-IDF vectors (see 
+tfidf_matcher.py), a sparse matrix product gives the similarity of every 
+intervention_name with every name, and only the TOP_K most similar names of 
+each intervention_name are kept as candidates. Only these are scored with 
+RERANK (WRatio or partial_ratio, which also find names such as 
+"recombinant GM-CSF" in "GM-CSF"), and the ones above RERANK_THRESHOLD are 
+matched. This mode gives different (more lenient) matches than the other 
+two, which are exact re-implementations of find_match().
+"""
+
+def build_tfidf_index(drugs_names):
+    """
+    Builds the TF-IDF vectors of all the names of all drugs.
+
+    Parameters
+    ----------
+    drugs_names : Iterable of name lists, with the primary name first.
+
+    Returns
+    -------
+    tfidf_index : Tuple with the primary names, the (drug row, processed 
+                  name) tuple of every vector and the output of build_tfidf().
+    """
+    drugs_names = list(drugs_names)
+    names = []
+    for drug_idx, drug in enumerate(drugs_names):
+        for name in drug:
+            processed = utils.default_process(name)
+            if (len(name)<=2) | (not processed):
+                continue
+            names.append((drug_idx, processed))
+    return ([i[0] for i in drugs_names], names, 
+            build_tfidf([x[1] for x in names]))
+
+def match_tfidf(interventions, tfidf_index):
+    """
+    Matches a list of intervention_names in 'tfidf' mode.
+
+    Parameters
+    ----------
+    interventions : List of intervention_name strings.
+    tfidf_index : Output of build_tfidf_index().
+
+    Returns
+    -------
+    matches : List with the matched primary names of each intervention_name,
+              in drug order.
+    """
+    primary_names, names, tfidf = tfidf_index
+    scorer = getattr(fuzz, RERANK) if RERANK else None
+    matches = []
+    for start in range(0, len(interventions), BATCH_SIZE):
+        block = [utils.default_process(x) for x in 
+                 interventions[start:start+BATCH_SIZE]]
+        scores = vectorize(block, tfidf) @ tfidf[2].T
+        for notes, candidates in zip(block, top_k(scores, TOP_K, 
+                                                  MIN_SIMILARITY)):
+            counters['tfidf candidates'] += len(candidates)
+            drug_matches = set()
+            for name_idx, similarity in candidates:
+                drug_idx, name = names[name_idx]
+                if drug_idx in drug_matches:
+                    continue
+                if scorer is None:
+                    if similarity >= SIMILARITY_THRESHOLD:
+                        drug_matches.add(drug_idx)
+                elif scorer(name, notes, processor = None, 
+                            score_cutoff = RERANK_THRESHOLD):
+                    drug_matches.add(drug_idx)
+            matches.append([primary_names[i] for i in sorted(drug_matches)])
+    return matches
+
+def build_indexes(drugs_names):
+    """
+    Builds everything the 'index' matching mode needs from the drug names.
+
+    Parameters
+    ----------
+    drugs_names : Iterable of name lists, with the primary name first.
+
+    Returns
+    -------
+    indexes : Tuple with the primary names, the output of build_exact_index()
+              and the output of build_gram_index(fuzzy_only = True).
+    """
+    drugs_names = list(drugs_names)
+    primary_names = [i[0] for i in drugs_names]
+    exact_index = build_exact_index(drugs_names)
+    drug_index = build_gram_index(drugs_names, fuzzy_only = True)
+    return primary_names, exact_index, drug_index
+
+def match_notes(notes, indexes):
+    """
+    Matches one intervention_name in 'index' mode.
+
+    Parameters
+    ----------
+    notes : intervention_name string.
+    indexes : Output of build_indexes().
+
+    Returns
+    -------
+    list
+        Primary names of the matched drugs, in drug order.
+    """
+    primary_names, exact_index, drug_index = indexes
+    table = {}
+    drug_matches = exact_matches(notes, *exact_index, table)
+    counters['exact'] += len(drug_matches)
+    for drug_idx, names in candidate_drugs(notes, *drug_index):
+        if drug_idx in drug_matches:
+            continue
+        if any(find_match(x, notes, table) for x in names): 
+            drug_matches.add(drug_idx)
+            counters['fuzzy'] += 1
+    return [primary_names[i] for i in sorted(drug_matches)]
 
-"""Lastly, the result dataframe is saved as a json file."""
+def match_distinct(distinct, drugs_names, indexes = None):
+    """
+    Matches a list of distinct intervention_names with the selected 
+    MATCHING_MODE.
+
+    Parameters
+    ----------
+    distinct : List of distinct intervention_name strings.
+    drugs_names : Iterable of name lists, with the primary name first.
+    indexes : Output of build_matching_indexes().
 
-parsed = [row.dropna().to_dict() for index, row in result.iterrows()]
+    Returns
+    -------
+    list
+        Matched primary names of each intervention_name.
+    """
+    if MATCHING_MODE == 'batch':
+        return match_batch(distinct, drugs_names)
+    if MATCHING_MODE == 'tfidf':
+        return match_tfidf(distinct, indexes)
+    return [match_notes(w, indexes) for w in distinct]
 
 """
-Code to save the result as a json lines file:
+Every intervention_name is matched independently of the others, so with 
+WORKERS > 1 the distinct intervention_names are split into shards of 
+SHARD_SIZE and matched by a process pool. The drug names and indexes are 
+handed to each worker once, when it starts (init_worker()), instead of being 
+pickled with every shard (in 'batch' mode, the worker also groups the names 
+once for all its shards). Each shard returns its matches together with the 
+counters it incremented, and pool.map() gives the shards back in order, so 
+the merged matches are the same as in a serial run.
+"""
+
+worker_state = {}
+
+def init_worker(drugs_names, indexes):
+    """
+    Keeps the drug names and indexes in the worker process.
+
+    Parameters
+    ----------
+    drugs_names : List of name lists, with the primary name first.
+    indexes : Output of build_indexes(), or None in 'batch' mode.
+
+    Returns
+    -------
+    None.
+    """
+    worker_state['drugs_names'] = drugs_names
+    worker_state['indexes'] = indexes
+    if MATCHING_MODE == 'batch':
+        worker_state['by_spaces'] = group_names(drugs_names)
+
+def match_shard(shard):
+    """
+    Matches a shard of distinct intervention_names in a worker process.
+
+    Parameters
+    ----------
+    shard : List of distinct intervention_name strings.
+
+    Returns
+    -------
+    matches : List with the matched primary names of each intervention_name.
+    shard_counters : Counters incremented while matching the shard.
+    """
+    counters.clear()
+    if MATCHING_MODE == 'batch':
+        matches = match_batch(shard, worker_state['drugs_names'], 
+                              worker_state['by_spaces'], workers = 1)
+    else:
+        matches = match_distinct(shard, worker_state['drugs_names'], 
+                                 worker_state['indexes'])
+    return matches, dict(counters)
 
-with open('Output/Task_1_output.jsonl', 'w') as outfile:
-    for entry in parsed:
-        json.dump(entry, outfile)
-        outfile.write('\n')
+def match_parallel(distinct, drugs_names, indexes = None, 
+                   workers = WORKERS, shard_size = SHARD_SIZE):
+    """
+    Matches a list of distinct intervention_names with a process pool.
+
+    Parameters
+    ----------
+    distinct : List of distinct intervention_name strings.
+    drugs_names : Iterable of name lists, with the primary name first.
+    indexes : Output of build_matching_indexes().
+    workers : Number of worker processes (None uses every CPU core).
+    shard_size : Number of intervention_names per shard.
+
+    Returns
+    -------
+    matches : List with the matched primary names of each intervention_name.
+    """
+    shards = [distinct[i:i + shard_size] 
+              for i in range(0, len(distinct), shard_size)]
+    workers = min(workers or os.cpu_count(), len(shards))
+    if workers <= 1:
+        return match_distinct(distinct, drugs_names, indexes)
+    
+    matches = []
+    with concurrent.futures.ProcessPoolExecutor(
+            workers, initializer = init_worker, 
+            initargs = (list(drugs_names), indexes)) as pool:
+        for shard_matches, shard_counters in pool.map(match_shard, shards):
+            matches.extend(shard_matches)
+            counters.update(shard_counters)
+    counters['shards'] += len(shards)
+    return matches
+
+def match_interventions(interventions, drugs_names, indexes = None, 
+                        cache = None):
+    """
+    Matches a list of intervention_names with the selected MATCHING_MODE, 
+    matching each distinct intervention_name only once.
+
+    Parameters
+    ----------
+    interventions : List of intervention_name strings.
+    drugs_names : Iterable of name lists, with the primary name first.
+    indexes : Output of build_matching_indexes().
+    cache : Tuple with the output of open_cache() and the fingerprint of the 
+            current drug names, or None to match everything.
+
+    Returns
+    -------
+    matches : List with the matched primary names of each intervention_name.
+    """
+    interventions = list(interventions)
+    distinct = list(dict.fromkeys(interventions))
+    counters['interventions'] += len(interventions)
+    counters['distinct interventions'] += len(distinct)
+    
+    matched = {}
+    if cache is not None:
+        matched = get_matches(*cache, distinct)
+        counters['cached interventions'] += len(matched)
+        distinct = [w for w in distinct if w not in matched]
+    
+    distinct_matches = match_parallel(distinct, drugs_names, indexes, 
+                                      WORKERS, SHARD_SIZE)
+    new_matches = dict(zip(distinct, distinct_matches))
+    if cache is not None:
+        put_matches(*cache, new_matches)
+    matched.update(new_matches)
+    return [list(matched[w]) for w in interventions]
+
+"""
+In streaming mode, the clinical trials are read in chunks of CHUNK_SIZE 
+records. Each chunk is filtered, matched and its trials with at least one 
+match are appended to a json lines file straight away, so the memory used does
+not depend on the size of the clinical trials file. Repeated 
+intervention_names are only deduplicated within a chunk. The output is always
+Output/Task_1_output.jsonl, whatever OUTPUT_FORMAT is, and task 3 reads it 
+because it is the most recent task 1 output (see find_output_file() in 
+outputs.py).
 """
 
-with open('Output/Task_1_output.json', 'w') as json_file:
-    json.dump(parsed, json_file, indent = 4)   
+def match_stream(trials_file, output_file, drugs_names, indexes = None, 
+                 cache = None):
+    """
+    Reads, filters and matches a clinical trials json lines file chunk by 
+    chunk and appends the results to a json lines file.
+
+    Parameters
+    ----------
+    trials_file : Path of the clinical trials json lines file.
+    output_file : Path of the json lines file to be written.
+    drugs_names : List of name lists, with the primary name first.
+    indexes : Output of build_matching_indexes().
+    cache : See match_interventions().
+
+    Returns
+    -------
+    None.
+    """
+    with pd.read_json(trials_file, lines = True, 
+                      chunksize = CHUNK_SIZE) as reader, open(
+                          output_file, 'w') as outfile:
+        for chunk in reader:
+            chunk = select_drug_interventions(chunk)
+            chunk['drugs'] = match_interventions(chunk.iloc[:,1], 
+                                                 drugs_names, indexes, cache)
+            chunk.drop(['intervention_name'], axis = 1, inplace = True)
+            chunk = chunk[chunk['drugs'].map(lambda x: len(x)) > 0]
+            write_jsonl(chunk, outfile)
+
+def build_matching_indexes(drugs_names):
+    """
+    Builds the indexes needed by the selected MATCHING_MODE.
+
+    Parameters
+    ----------
+    drugs_names : List of name lists, with the primary name first.
+
+    Returns
+    -------
+    indexes : Output of build_indexes() in 'index' mode, of 
+              build_tfidf_index() in 'tfidf' mode, or None in 'batch' mode.
+    """
+    if MATCHING_MODE == 'batch':
+        return None
+    if MATCHING_MODE == 'tfidf':
+        return build_tfidf_index(drugs_names)
+    return build_indexes(drugs_names)
+
+def get_matching_fingerprint(drugs_names):
+    """
+    Hashes everything the matches depend on, for the match cache. The 'index' 
+    and 'batch' modes give the same matches, so they share their entries.
+
+    Parameters
+    ----------
+    drugs_names : Sequence of name lists, with the primary name first.
+
+    Returns
+    -------
+    str
+        Fingerprint of the drug names and matching settings.
+    """
+    drugs_names = list(drugs_names)
+    if MATCHING_MODE == 'tfidf':
+        return get_fingerprint(drugs_names, 'tfidf', TOP_K, MIN_SIMILARITY, 
+                               RERANK, RERANK_THRESHOLD, SIMILARITY_THRESHOLD)
+    return get_fingerprint(drugs_names, 'QRatio', 'default_process', 
+                           SCORE_THRESHOLD)
+
+def prepare_matching(drugs_names):
+    """
+    Builds the indexes needed by the selected MATCHING_MODE and opens the 
+    match cache if USE_CACHE is True.
+
+    Parameters
+    ----------
+    drugs_names : List of name lists, with the primary name first.
+
+    Returns
+    -------
+    indexes : Output of build_matching_indexes().
+    cache : Tuple with the cache connection and fingerprint, or None.
+    """
+    indexes = build_matching_indexes(drugs_names)
+    
+    cache = None
+    if USE_CACHE:
+        cache = (open_cache(), get_matching_fingerprint(drugs_names))
+    return indexes, cache
+
+def match_trials(drugs, clinical_trials, drugs_names = None):
+    """
+    Runs task 1 on the drugs and clinical trials dataframes.
+
+    Parameters
+    ----------
+    drugs : Drugs dataframe, as read from drugs.csv.
+    clinical_trials : Clinical trials dataframe, as read from 
+                      clinical_trials_2015.jsonl.
+    drugs_names : Names read from a compiled dictionary, used instead of 
+                  drugs if given.
+
+    Returns
+    -------
+    result : Dataframe with the nct_id and the matched drugs of every trial 
+             with at least one match.
+    """
+    with measure('task_1', 'normalize'):
+        if drugs_names is None:
+            drugs_names = get_drug_names(drugs)
+        clinical_trials_drug_intervention = select_drug_interventions(
+            clinical_trials)
+    with measure('task_1', 'match'):
+        matches = match_interventions(
+            clinical_trials_drug_intervention.iloc[:,1], drugs_names, 
+            *prepare_matching(drugs_names))
+     
+    """
+    The matches list is appended to the nct_id column from the 
+    clinical_trials_drug_intervention dataframe. All clinical trials without a 
+    match are dropped from the final file.
+    """  
+     
+    result = clinical_trials_drug_intervention.copy()
+    result['drugs'] = matches
+    result.drop(['intervention_name'], axis = 1, inplace = True)
+    result = result[result['drugs'].map(lambda x: len(x)) > 0]
+    return result
+
+def print_counters():
+    """
+    Prints the deduplication, cache and matching path counters (or the 
+    number of TF-IDF candidates in 'tfidf' mode).
+
+    Returns
+    -------
+    None.
+    """
+    if counters['interventions']:
+        print('Distinct intervention_names: {} of {} '
+              '(dedup ratio {:.2f})'.format(
+                  counters['distinct interventions'], 
+                  counters['interventions'],
+                  counters['interventions'] / 
+                  counters['distinct interventions']))
+    if USE_CACHE:
+        print('Distinct intervention_names found in the cache: {}'.format(
+            counters['cached interventions']))
+    if MATCHING_MODE == 'tfidf':
+        print('TF-IDF candidates scored: {}'.format(
+            counters['tfidf candidates']))
+    if MATCHING_MODE == 'index':
+        print('Matches per path: exact {}, fuzzy {}'.format(
+            counters['exact'], counters['fuzzy']))
+        windows = (counters['windows scored'] + 
+                   counters['windows pruned by length'] + 
+                   counters['windows pruned by characters'])
+        if windows:
+            print('Windows pruned before scoring: {:.1%} by length, '
+                  '{:.1%} by characters'.format(
+                      counters['windows pruned by length'] / windows,
+                      counters['windows pruned by characters'] / windows))
+
+if __name__ == '__main__':
+    drugs = drugs_names = None
+    with measure('task_1', 'load'):
+        if USE_DICTIONARY:
+            drugs_names = drug_dictionary.open_dictionary()['names']
+        else:
+            drugs = pd.read_csv('drugs.csv')
+    
+    if STREAMING:
+        if drugs_names is None:
+            drugs_names = get_drug_names(drugs)
+        with measure('task_1', 'match'):
+            match_stream('clinical_trials_2015.jsonl', 
+                         get_output_file('Task_1', 'jsonl'), drugs_names, 
+                         *prepare_matching(drugs_names))
+    else:
+        with measure('task_1', 'load'):
+            clinical_trials = pd.read_json('clinical_trials_2015.jsonl', 
+                                           lines = True) 
+        result = match_trials(drugs, clinical_trials, drugs_names)
+        
+        """
+        Lastly, the result dataframe is saved as a json file, or as a compact
+        json lines file if OUTPUT_FORMAT is set to 'jsonl' in outputs.py (see
+        match_stream() for the chunked version).
+        """
+        
+        with measure('task_1', 'serialize'):
+            write_output(result, get_output_file('Task_1'))
+    
+    print_counters()
+    write_metrics('Output/Task_1_metrics.json')
 
- 
 """
 Notes and assumptions:
     
@@ -1,27 +1,51 @@
 import pandas as pd
 import numpy as np
 import csv
-import json
 import re 
 
+import drug_dictionary
+from aho_corasick import build_automaton, find_all
+from outputs import get_output_file, write_output
+from instrumentation import counters, measure, write_metrics
+
 """
 In this task, I start by loading the drug file and extracting the primary name.
 Then I remove all special characters and numbers and separate the names into 
 words to account for multi-word names (This way, all words in a drug name can 
 be analysed separately).
+
+The files are loaded at the end of the script, so that the functions below 
+can also be imported by pipeline.py and run on data that is already in memory.
+When USE_DICTIONARY is set to True, the primary names and the rows of the 
+usan_stems file are read from the file compiled by drug_dictionary.py instead.
 """
 
-drugs_file = pd.read_csv('drugs.csv')
-drug_prim_name = drugs_file[['itemLabel']].copy()
+USE_DICTIONARY = False
+
+def get_drug_words(drugs_file):
+    """
+    Splits the primary name of every drug into words, without special 
+    characters or numbers.
 
-drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].map(
-    lambda x: re.sub(r'\W+', ' ', x))
-drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].map(
-    lambda x: re.sub(r'\d+', ' ', x))
-drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].map(
-    lambda x: x.strip())
-drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].str.split(
-    ' ', expand = False)
+    Parameters
+    ----------
+    drugs_file : Drugs dataframe, as read from drugs.csv.
+
+    Returns
+    -------
+    drug_prim_name : Dataframe with the list of words of each primary name.
+    """
+    drug_prim_name = drugs_file[['itemLabel']].copy()
+    
+    drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].map(
+        lambda x: re.sub(r'\W+', ' ', x))
+    drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].map(
+        lambda x: re.sub(r'\d+', ' ', x))
+    drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].map(
+        lambda x: x.strip())
+    drug_prim_name['itemLabel'] = drug_prim_name['itemLabel'].str.split(
+        ' ', expand = False)
+    return drug_prim_name
 
 """
 I load the usan_stem file and create a dataframe. I assume the examples can be 
@@ -40,77 +64,265 @@ in the usan_codes column (this is done to match the desired output format).
 The description and type columns are dropped.  
 """
 
-with open("usan_stems.csv") as file:
-    csvreader = csv.reader(file)
-    header = next(csvreader)
-    usan_stem = []
-    for row in csvreader:
-        usan_stem.append(row)
-
-usan_stem = pd.DataFrame(usan_stem)
-usan_stem = usan_stem.iloc[:,:3]
-usan_stem = usan_stem.replace({'"':''}, regex=True)
-usan_stem.columns = ['name', 'stem', 'description']
-usan_stem['stem'] = usan_stem['stem'].replace({' ':''}, regex = True)
-
-usan_stem.loc[usan_stem['name'] == '','type'] = 'subclass'
-usan_stem['type'] = usan_stem['type'].fillna(0)
-usan_stem.loc[usan_stem['type'] == 0,'type'] = 'class'
-usan_stem.loc[usan_stem['stem'] == '', 'type'] = None
-
-usan_stem.drop(['name'], axis = 1, inplace = True)
-usan_stem = usan_stem.dropna(axis = 0, inplace = False)
-usan_stem['stem'] = usan_stem['stem'].str.split(',',expand = False)
-usan_stem['usan_codes']=usan_stem[['description', 'type']].to_dict(orient = 'records')
-usan_stem.drop(['description', 'type'], axis = 1, inplace = True)
+def read_usan_stems(stems_file):
+    """
+    Reads the rows of the usan_stems file (without the header).
 
-"""
-A new dataframe is created to include the drug name and the column usan_codes 
-filled with empty lists into which the matching description will be appended.
-"""
-drugs_df = drug_prim_name.copy()
-drugs_df['usan_codes'] = np.empty((len(drugs_df), 0)).tolist()
-drugs_df.columns = ['drug', 'usan_codes']
+    Parameters
+    ----------
+    stems_file : Path of the usan_stems csv file.
 
-"""
-The following piece of code describes four nested loops that visit all the 
-words in each drug name and compare them with all the stems. If a prefix, 
-infix or suffix is found to be a match, then the accompanying dictionary, which 
-contains the description and type, is appended to usan_codes column in the 
-corresponding drug's row.   
-"""
+    Returns
+    -------
+    usan_stem : List of rows.
+    """
+    with open(stems_file) as file:
+        csvreader = csv.reader(file)
+        header = next(csvreader)
+        usan_stem = []
+        for row in csvreader:
+            usan_stem.append(row)
+    return usan_stem
+
+def get_usan_codes(usan_stem):
+    """
+    Builds the dataframe with the list of stem elements and the usan code 
+    (description and type) of every stem.
+
+    Parameters
+    ----------
+    usan_stem : Output of read_usan_stems().
+
+    Returns
+    -------
+    usan_stem : Dataframe with the stem and usan_codes columns.
+    """
+    usan_stem = pd.DataFrame(usan_stem)
+    usan_stem = usan_stem.iloc[:,:3]
+    usan_stem = usan_stem.replace({'"':''}, regex=True)
+    usan_stem.columns = ['name', 'stem', 'description']
+    usan_stem['stem'] = usan_stem['stem'].replace({' ':''}, regex = True)
+    
+    usan_stem.loc[usan_stem['name'] == '','type'] = 'subclass'
+    usan_stem['type'] = usan_stem['type'].fillna(0)
+    usan_stem.loc[usan_stem['type'] == 0,'type'] = 'class'
+    usan_stem.loc[usan_stem['stem'] == '', 'type'] = None
+    
+    usan_stem.drop(['name'], axis = 1, inplace = True)
+    usan_stem = usan_stem.dropna(axis = 0, inplace = False)
+    usan_stem['stem'] = usan_stem['stem'].str.split(',',expand = False)
+    usan_stem['usan_codes']=usan_stem[['description', 'type']].to_dict(orient = 'records')
+    usan_stem.drop(['description', 'type'], axis = 1, inplace = True)
+    return usan_stem
 
-drugs = drugs_df.iloc[:,0]
-stems = usan_stem.iloc[:,0]
-
-for idx_drug, drug in enumerate(drugs):
-    for word in drug:
-        for idx_stem, stem in enumerate(stems):
-            for element in stem:
-                if element.endswith('-') and not element.startswith('-'):  # is a prefix
-                    if word.startswith(element[:-1]):
-                        drugs_df.iloc[idx_drug,1].append(usan_stem.iloc[idx_stem, 1])
-                elif element.startswith('-') and element.endswith('-'):  # It is a infix
-                    if element[1:-1] in word[1:-1]:
-                        drugs_df.iloc[idx_drug,1].append(usan_stem.iloc[idx_stem, 1])
-                elif element.startswith('-') and not element.endswith('-'):  # It is a sufix
-                    if word.endswith(element[1:]):
-                        drugs_df.iloc[idx_drug,1].append(usan_stem.iloc[idx_stem, 1])
-                        
 """
-I've replace the column with the list of words in each drug name with the drug name 
-string (with special characters and digits) to match the desired output and 
-drop all rows without a match.
+To classify the words of the drug names, the stems are compiled into an index
+instead of comparing every word with every stem. Prefixes ('xxx-') are stored 
+in a trie, so all the prefixes of a word are found by walking the trie along 
+its characters. Suffixes ('-xxx') are stored in a second trie built over the 
+reversed stems and walked along the reversed word. Infixes ('-xxx-') must be 
+found inside the word without its first and last characters, which is done 
+in one pass with an Aho-Corasick automaton. Stem elements without any 
+letters between the hyphens (e.g. '-') match every word.
+
+Every stem element has an id following the order of the stems file, so 
+sorting the ids of the elements matched by a word gives the same order in 
+which the nested loops (word, stem, element) appended the codes. Drug names 
+share many words, so the matches of each distinct word are only computed once.
 """
-drugs_df['drug'] = drugs_file['itemLabel']
-drugs_trimmed = drugs_df[drugs_df['usan_codes'].map(lambda x: len(x)) > 0]
 
-"""Lastly, the result dataframe is saved as a json file."""
+def build_trie(patterns):
+    """
+    Builds a trie over a list of patterns.
+
+    Parameters
+    ----------
+    patterns : List of (pattern, id) tuples. 
+
+    Returns
+    -------
+    trie : Tuple with the transitions of each node (list of dictionaries) and
+           the ids of the patterns ending at each node (list of lists).
+    """
+    goto = [{}]
+    ids = [[]]
+    for pattern, pattern_id in patterns:
+        node = 0
+        for char in pattern:
+            if char not in goto[node]:
+                goto[node][char] = len(goto)
+                goto.append({})
+                ids.append([])
+            node = goto[node][char]
+        ids[node].append(pattern_id)
+    return goto, ids
 
-parsed = [row.dropna().to_dict() for index,row in drugs_trimmed.iterrows()]
+def find_prefixes(trie, word):
+    """
+    Finds all the patterns of a trie that are prefixes of a word.
 
-with open('Output/Task_2_output.json', 'w') as json_file:
-    json.dump(parsed, json_file, indent = 4)                    
+    Parameters
+    ----------
+    trie : Output of build_trie().
+    word : Word to be looked up.
+
+    Returns
+    -------
+    list
+        Ids of the matching patterns.
+    """
+    goto, ids = trie
+    found = []
+    node = 0
+    for char in word:
+        node = goto[node].get(char)
+        if node is None:
+            break
+        found.extend(ids[node])
+    return found
+
+def build_stem_index(stems):
+    """
+    Compiles the stems into the prefix trie, the suffix trie and the infix 
+    automaton.
+
+    Parameters
+    ----------
+    stems : Iterable with the list of stem elements of each stem row.
+
+    Returns
+    -------
+    stem_index : Tuple (prefix trie, suffix trie, infix automaton, ids of the
+                 elements behind each infix pattern, ids of the elements 
+                 matching every word).
+    element_stems : List with the stem row of each element id.
+    """
+    element_stems = []
+    prefixes = []
+    suffixes = []
+    infixes = {}
+    always = []
+    for idx_stem, stem in enumerate(stems):
+        for element in stem:
+            element_id = len(element_stems)
+            element_stems.append(idx_stem)
+            if element.endswith('-') and not element.startswith('-'):  # is a prefix
+                prefixes.append((element[:-1], element_id))
+            elif element.startswith('-') and element.endswith('-'):  # It is a infix
+                if element[1:-1]:
+                    infixes.setdefault(element[1:-1], []).append(element_id)
+                else:
+                    always.append(element_id)
+            elif element.startswith('-') and not element.endswith('-'):  # It is a sufix
+                suffixes.append((element[1:][::-1], element_id))
+    stem_index = (build_trie(prefixes), build_trie(suffixes), 
+                  build_automaton(list(infixes)), list(infixes.values()), 
+                  always)
+    return stem_index, element_stems
+
+def classify_word(word, stem_index):
+    """
+    Finds all the stem elements matched by a word.
+
+    Parameters
+    ----------
+    word : Word of a drug name.
+    stem_index : Output of build_stem_index().
+
+    Returns
+    -------
+    list
+        Sorted ids of the matched stem elements.
+    """
+    prefix_trie, suffix_trie, infix_automaton, infix_ids, always = stem_index
+    matched = find_prefixes(prefix_trie, word)
+    matched.extend(find_prefixes(suffix_trie, word[::-1]))
+    for pattern_id in {x for start, x in find_all(infix_automaton, word[1:-1])}:
+        matched.extend(infix_ids[pattern_id])
+    matched.extend(always)
+    return sorted(matched)
+
+def classify_drugs(drugs_file, usan_stem):
+    """
+    Runs task 2 on the drugs dataframe and the rows of the usan_stems file.
+
+    Parameters
+    ----------
+    drugs_file : Drugs dataframe, as read from drugs.csv.
+    usan_stem : Output of read_usan_stems().
+
+    Returns
+    -------
+    drugs_trimmed : Dataframe with the drug name and the matched usan codes 
+                    of every drug with at least one match.
+    """
+    with measure('task_2', 'normalize'):
+        drug_prim_name = get_drug_words(drugs_file)
+        usan_stem = get_usan_codes(usan_stem)
+    
+    """
+    A new dataframe is created to include the drug name and the column 
+    usan_codes filled with empty lists into which the matching description 
+    will be appended.
+    """
+    drugs_df = drug_prim_name.copy()
+    drugs_df['usan_codes'] = np.empty((len(drugs_df), 0)).tolist()
+    drugs_df.columns = ['drug', 'usan_codes']
+    
+    """
+    The following piece of code visits all the words in each drug name and 
+    classifies them with the stem index. For every matched prefix, infix or 
+    suffix, the accompanying dictionary, which contains the description and 
+    type, is appended to the list of codes of the corresponding drug.   
+    """
+    
+    with measure('task_2', 'match'):
+        drugs = drugs_df.iloc[:,0]
+        stem_index, element_stems = build_stem_index(usan_stem.iloc[:,0])
+        codes = usan_stem.iloc[:,1].tolist()
+        
+        word_codes = {}
+        drug_codes = []
+        for drug in drugs:
+            drug_codes.append([])
+            for word in drug:
+                if word not in word_codes:
+                    word_codes[word] = [codes[element_stems[i]] for i in 
+                                        classify_word(word, stem_index)]
+                drug_codes[-1].extend(word_codes[word])
+        drugs_df['usan_codes'] = drug_codes
+    counters['stem elements'] += len(element_stems)
+    counters['distinct words classified'] += len(word_codes)
+    counters['stem matches'] += sum(len(x) for x in drug_codes)
+                            
+    """
+    I've replace the column with the list of words in each drug name with the 
+    drug name string (with special characters and digits) to match the desired
+    output and drop all rows without a match.
+    """
+    drugs_df['drug'] = drugs_file['itemLabel']
+    drugs_trimmed = drugs_df[drugs_df['usan_codes'].map(lambda x: len(x)) > 0]
+    return drugs_trimmed
+
+if __name__ == '__main__':
+    with measure('task_2', 'load'):
+        if USE_DICTIONARY:
+            dictionary = drug_dictionary.open_dictionary()
+            drugs_file = drug_dictionary.get_drugs(dictionary)
+            usan_stem = list(dictionary['stems'])
+        else:
+            drugs_file = pd.read_csv('drugs.csv')
+            usan_stem = read_usan_stems("usan_stems.csv")
+    drugs_trimmed = classify_drugs(drugs_file, usan_stem)
+    
+    """
+    Lastly, the result dataframe is saved as a json file (or json lines, see 
+    OUTPUT_FORMAT in outputs.py).
+    """
+    
+    with measure('task_2', 'serialize'):
+        write_output(drugs_trimmed, get_output_file('Task_2'))
+    write_metrics('Output/Task_2_metrics.json')
 
 """
 Notes and assumptions:
@@ -1,106 +1,165 @@
 import pandas as pd
 import numpy as np
-import json
 
-"""
-I start by loading the output of the previous two tasks.
-"""
-
-task_1 = pd.read_json('Output/Task_1_output.json') 
-task_2 = pd.read_json('Output/Task_2_output.json')
-
-"""
-From task_2, I extracted all the descriptions and types per drug. To do 
-this, I separated the names from the codes.
-"""
-
-all_names = task_2.iloc[:,0].values.tolist()
-all_codes = task_2.iloc[:,1].values.tolist()
-
-"""
-Now, since the all_codes list contains lists of dictionaries for every stem
-match, I've extracted all the dictionaries in a dataframe. Subsequently, I've 
-computed the number of unique descriptions.
-"""
-
-all_codes_flat = [j for i in all_codes for j in i]
-extended_df = pd.DataFrame(all_codes_flat)
-unique_descriptions = extended_df.copy()
-unique_descriptions = unique_descriptions.drop_duplicates()
-
-
-"""
-Now I create a list with the names to match the flattened description dataframe.
-For instance, If a drug has four matching descriptions, a list is created in 
-which that drug's name is repeated four times to match the descriptions dataframe
-produced before, extended_df.  
-
-I dropped the duplicates in the resulting dataframe. The reason is that
-a drug such as Natalizumab has three identical matches to -mab, -umab and 
--zumab with identical description. Similarly, other trials could have used two
-drugs with the same description. I assume we are interested in the 'class' of
-drugs used, so there is no need to keep the duplicates. 
-"""
-
-num_of_entries = list(map(len, all_codes))
-all_names_flat = [[a]*b for a, b in zip(all_names, num_of_entries)]
-all_names_flat = [j for i in all_names_flat for j in i]
-extended_df.insert(2, 'names', all_names_flat)
-extended_df.drop_duplicates(inplace = True)
-
-"""
-Then I create a drugs column with all the drugs matching the description of 
-each row. Then by dropping the names, I can then eliminate all the duplicates. 
-The resulting dataframe has all unique descriptions and a list of drugs that 
-match them. I then add a trials column with empty lists to which all matching 
-trials can be appended.
-"""
-
-extended_df['drugs'] = extended_df.groupby(['description'])['names'].transform(lambda x: '|'.join(x))
-extended_df.drop(['names'], axis = 1, inplace = True)
-extended_df.drop_duplicates(inplace = True)
-extended_df['drugs'] = extended_df['drugs'].str.split('|', expand = False)
-extended_df['trials'] = np.empty((len(unique_descriptions), 0)).tolist() 
-
-"""
-These nested loops go through all the drugs used in a trial and check whether 
-or not they matched any drugs in the extended_df dataframe. If they do, then 
-the trial number is appended to the trial list corresponding to that description.
-"""
-
-import time
-start_time = time.time()
-for idx, trial in task_1.iterrows():
-    for i in trial[1]:
-        for idx, usan_codes in extended_df.iterrows():
-            for j in usan_codes[2]:
-                if i == j:
-                    usan_codes[3].append(trial[0])
-                    
-"""
-Lastly, the drugs column is dropped and the resulting dataframe is saved as a
-json file.
-"""
-
-extended_df.drop(['drugs'], axis = 1, inplace = True)
-parsed = [row.dropna().to_dict() for index, row in extended_df.iterrows()]
-
-"""
-Code to save the result as a json lines file:
+from outputs import (find_output_file, get_output_file, read_output, 
+                     write_output)
+from instrumentation import counters, measure, write_metrics
+
+"""
+I start by loading the output of the previous two tasks. The files are loaded 
+at the end of the script, so that group_trials() can also be imported by 
+pipeline.py and run on the outputs of the previous tasks while they are still 
+in memory.
+"""
+
+def get_descriptions(task_2):
+    """
+    Builds the dataframe with every unique description and type and the ids 
+    of the drugs that match it.
+
+    Parameters
+    ----------
+    task_2 : Dataframe with the drug name and usan codes of every drug.
+
+    Returns
+    -------
+    extended_df : Dataframe with the description, type and drugs (array of 
+                  drug ids) columns.
+    drug_names : Array with the name of every drug id.
+    """
+    """
+    From task_2, I extracted all the descriptions and types per drug. To do 
+    this, I separated the names from the codes. The drug names are interned 
+    into integer ids (pd.factorize() gives the same id to repeated names), so 
+    the tables built below hold one integer per match instead of the name.
+    """
+
+    drug_ids, drug_names = pd.factorize(task_2.iloc[:,0])
+    all_codes = task_2.iloc[:,1].values.tolist()
+
+    """
+    Now, since the all_codes list contains lists of dictionaries for every stem
+    match, I've extracted all the dictionaries in a dataframe.
+    """
+
+    all_codes_flat = [j for i in all_codes for j in i]
+    extended_df = pd.DataFrame(all_codes_flat)
+
+    """
+    Now I add the drug ids to the flattened description dataframe. For 
+    instance, if a drug has four matching descriptions, its id is repeated 
+    four times to match the descriptions dataframe produced before, extended_df.
+
+    I dropped the duplicates in the resulting dataframe. The reason is that
+    a drug such as Natalizumab has three identical matches to -mab, -umab and 
+    -zumab with identical description. Similarly, other trials could have used two
+    drugs with the same description. I assume we are interested in the 'class' of
+    drugs used, so there is no need to keep the duplicates. 
+    """
+
+    num_of_entries = list(map(len, all_codes))
+    extended_df['drug_id'] = np.repeat(drug_ids, num_of_entries)
+    extended_df.drop_duplicates(inplace = True)
+
+    """
+    Then the descriptions are interned as well, and the drug ids of every 
+    description are gathered in an array (in the order in which they were 
+    found). Keeping the first row of every description and type, the resulting 
+    dataframe has all unique descriptions and the array of drugs that match them.
+    """
+
+    description_ids, descriptions = pd.factorize(extended_df['description'])
+    order = np.argsort(description_ids, kind = 'stable')
+    description_drugs = np.split(
+        extended_df['drug_id'].to_numpy()[order], 
+        np.cumsum(np.bincount(description_ids))[:-1])
     
-with open('Output/Task_3_output.jsonl', 'w') as outfile:
-    for entry in parsed:
-        json.dump(entry, outfile)
-        outfile.write('\n')
-"""
-
-with open('Output/Task_3_output.json', 'w') as json_file:
-    json.dump(parsed, json_file, indent = 4)  
+    extended_df['description_id'] = description_ids
+    extended_df = extended_df.drop_duplicates(['description', 'type'])
+    extended_df['drugs'] = [description_drugs[i] for i in 
+                            extended_df['description_id']]
+    extended_df.drop(['drug_id', 'description_id'], axis = 1, inplace = True)
+    return extended_df, drug_names
+
+def group_trials(task_1, task_2):
+    """
+    Runs task 3 on the outputs of the first two tasks.
+
+    Parameters
+    ----------
+    task_1 : Dataframe with the nct_id and drugs of every matched trial.
+    task_2 : Dataframe with the drug name and usan codes of every drug.
+
+    Returns
+    -------
+    extended_df : Dataframe with the description, type and list of trials of 
+                  every usan code.
+    """
+    with measure('task_3', 'normalize'):
+        extended_df, drug_names = get_descriptions(task_2)
+
+    """
+    Matching the drugs of each trial against every description is really a join, 
+    so it is done as one on integer ids. The drugs of every trial are interned 
+    with the drug names of task 2 (drugs that task 2 did not classify get -1 and 
+    join nothing) and each trial is identified by its row in task_1. Merging the 
+    trial drugs with the (drug, row of extended_df) pairs on the drug id gives 
+    every trial a description row should list. Sorting them by row, and then by 
+    position of the trial drug, puts the trials in the same order as if every 
+    trial had been appended while going through the drugs of task_1. The 
+    nct_id strings are only looked up at the end. The columns of task_1 are 
+    selected by name, since the output of a task 1 run without matches is read 
+    back without any columns (every description then gets an empty list).
+    """
+
+    with measure('task_3', 'join'):
+        task_1 = task_1.reindex(columns = ['nct_id', 'drugs'])
+        trial_drugs = task_1['drugs']
+        entries = pd.DataFrame({
+            'trial': np.repeat(np.arange(len(task_1)), trial_drugs.map(len)),
+            'drug_id': pd.Index(drug_names).get_indexer(
+                [j for i in trial_drugs for j in i])})
+        edges = pd.DataFrame({
+            'drug_id': np.concatenate(extended_df['drugs'].tolist()),
+            'row': np.repeat(np.arange(len(extended_df)), 
+                             extended_df['drugs'].map(len))})
+        
+        joined = entries.reset_index().merge(edges, on = 'drug_id')
+        joined.sort_values(['row', 'index'], kind = 'stable', inplace = True)
+        trial_nct_ids = task_1['nct_id'].to_numpy()[joined['trial'].to_numpy()]
+        trials = np.split(trial_nct_ids, np.cumsum(np.bincount(
+            joined['row'], minlength = len(extended_df)))[:-1])
+        extended_df['trials'] = [x.tolist() for x in trials]
+    counters['trial drugs looked up'] += len(entries)
+    counters['rows joined'] += len(joined)
+    
+    """
+    Lastly, the drugs column is dropped.
+    """
+    
+    extended_df.drop(['drugs'], axis = 1, inplace = True)
+    return extended_df
+
+if __name__ == '__main__':
+    with measure('task_3', 'load'):
+        task_1 = read_output(find_output_file('Task_1')) 
+        task_2 = read_output(find_output_file('Task_2'))
+    extended_df = group_trials(task_1, task_2)
+    
+    """
+    The resulting dataframe is saved as a json file (or as a compact json lines 
+    file if OUTPUT_FORMAT is set to 'jsonl' in outputs.py).
+    """
+    
+    with measure('task_3', 'serialize'):
+        write_output(extended_df, get_output_file('Task_3'))
+    write_metrics('Output/Task_3_metrics.json')
 
 """
 Notes and assumptions:
     
-  - In my machine, this script takes 3 minutes.
+  - In my machine, this script takes less than a second (it took 3 minutes
+    before the nested loops were replaced by the drug lookup).
   
   - As mentioned before, I assume that since we are interested in the 'class'
     of the drug, meaning the description, then drugs with matches to stems with 
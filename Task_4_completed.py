@@ -1,117 +1,270 @@
 import pandas as pd
-import json
+import numpy as np
 
-import itertools
-import collections
+from scipy import sparse
+
+from outputs import (find_output_file, get_output_file, read_output, 
+                     write_output)
+from instrumentation import counters, measure, write_metrics
 
 """
-I start by loading the prevous task's output.
+I start by loading the prevous task's output. The file is loaded at the end of
+the script, so that count_pairs() can also be imported by pipeline.py and run 
+on the output of task 3 while it is still in memory.
 """
 
-task_3 = pd.read_json('Output/Task_3_output.json')
+def get_trial_descriptions(task_3):
+    """
+    Flattens the output of task 3 into unique (trial id, description id) 
+    pairs of the drug classes.
 
-"""
-Similarly to task 3, I extract the codes(description plus type) and the list 
-of trials. Subsequently, I extract all the trials into a list and create a 
-list of the codes repeated per number of associated trials(i.e. if a 
-description has three trials, then the description is repeated three times).
-These two lists are put together as all_trials_flat dataframe.
-"""
+    Parameters
+    ----------
+    task_3 : Dataframe with the description, type and list of trials of 
+             every usan code.
 
-all_codes = task_3.iloc[:,:2].values.tolist()
-all_trials = task_3.iloc[:,2].values.tolist()
+    Returns
+    -------
+    trial_ids : Array with the trial id of every pair.
+    description_ids : Array with the description id of every pair.
+    trials : Array with the nct_id of every trial id.
+    descriptions : Array with the description of every description id.
+    """
+    """
+    Similarly to task 3, the trials and descriptions are interned into integer 
+    ids with pd.factorize(), and only the ids are flattened. Only the rows with 
+    type = class get a description id (the subclasses get -1), so the 
+    descriptions keep the order in which they appear as classes in the task 3 
+    output. Subsequently, I extract all the trials into a list and repeat the 
+    description id of every row per number of associated trials (i.e. if a 
+    description has three trials, then its id is repeated three times). The 
+    pairs of the subclasses are then dropped.
+    """
 
-all_trials_flat = [j for i in all_trials for j in i]
-all_trials_flat = pd.DataFrame(all_trials_flat)
+    description_ids, descriptions = pd.factorize(
+        task_3.iloc[:,0].where(task_3.iloc[:,1] == 'class'))
+    all_trials = task_3.iloc[:,2].values.tolist()
 
-num_of_trials = list(map(len,all_trials))
-codes = [[a]*b for a,b in zip(all_codes, num_of_trials)]
-codes = [j for i in codes for j in i]
+    trial_ids, trials = pd.factorize(np.array([j for i in all_trials for j in i], 
+                                               dtype = object))
+    num_of_trials = list(map(len, all_trials))
+    description_ids = np.repeat(description_ids, num_of_trials)
 
-all_trials_flat.insert(1, 'codes', codes)
+    is_class = description_ids >= 0
+    trial_ids = trial_ids[is_class]
+    description_ids = description_ids[is_class]
 
-"""
-The codes column is then split into description and type. Codes column is 
-dropped, as well as the rows with type = subclass. Then the type column is also 
-dropped.
-"""
-all_trials_flat[['description', 'type']] = pd.DataFrame(all_trials_flat['codes'].to_list())
-all_trials_flat.drop(['codes'], axis = 1, inplace = True)
-all_trials_flat = all_trials_flat[all_trials_flat['type'] == 'class']
-all_trials_flat.drop(['type'], axis = 1, inplace = True)
+    """
+    The duplicates are dropped. As I did with task 3, I assume that only drug 
+    classes matter here. I duplicates were not dropped, then it would be 
+    possible to count pairs like:
 
-"""
-The columns are renamed, and the duplicates are dropped. As I did with task 3, I 
-assume that only drug classes matter here. I duplicates were not dropped, then 
-it would be possible to count pairs like:
-    
-    {
-    'description_1': 'iodine-containing contrast media', 
-    'description_2': 'iodine-containing contrast media'
-    } 
+        {
+        'description_1': 'iodine-containing contrast media', 
+        'description_2': 'iodine-containing contrast media'
+        } 
 
-Which I assume is undesirable given my understanding of the task. 
-"""
+    Which I assume is undesirable given my understanding of the task. 
+    """
 
-all_trials_flat.columns = ['trial', 'description']
-all_trials_flat.drop_duplicates(inplace = True)
+    num_of_descriptions = max(len(descriptions), 1)
+    pairs = np.unique(trial_ids * num_of_descriptions + description_ids)
+    trial_ids, description_ids = np.divmod(pairs, num_of_descriptions)
+    return trial_ids, description_ids, trials, descriptions
 
-"""
-Here I create a new dataframe named duplicated_trials with only the rows that 
-have a with a duplicated trial in the dataset, meaning that the 
-duplicated_trials dataframe only contains trials that matched to more than 
-one drug class. 
-
-Sorting by trial is unnecessary, but the reassignment of the duplicated_trials
-dataframe avoids a warning message issued by line 79. The same can be 
-accomplished by deep copying the dataframe. 
-"""
+def count_pairs(task_3):
+    """
+    Runs task 4 on the output of task 3.
 
-duplicated_trials =  all_trials_flat[all_trials_flat['trial'].duplicated(keep = False)]
-duplicated_trials = duplicated_trials.sort_values(by = ['trial'])
+    Parameters
+    ----------
+    task_3 : Dataframe with the description, type and list of trials of 
+             every usan code.
 
-"""
-The following step is to create a new column in which all the descriptions 
-associated with a trial number are grouped together. We then drop the 
-description column and the duplicates.
-"""
+    Returns
+    -------
+    result_df : Dataframe with the pairs of drug classes and the number of 
+                trials in which both appear.
+    """
+    with measure('task_4', 'normalize'):
+        trial_ids, description_ids, trials, descriptions = \
+            get_trial_descriptions(task_3)
+
+    """
+    In order to count how frequent a pair of drug classes is, a sparse 
+    trial x description incidence matrix is built from the ids. The product of 
+    its transpose with itself gives, for every pair of descriptions, the number 
+    of trials in which both appear. Only the upper triangle is kept, so every 
+    pair is counted once regardless of the order in which its descriptions were 
+    found (description_1 is always the one that comes first in the task 3 
+    output). Trials with a single drug class only contribute to the diagonal, 
+    which is dropped.
 
-duplicated_trials['Groups'] = duplicated_trials.groupby(['trial'])['description'].transform(lambda x: '|'.join(x))
-duplicated_trials.drop(['description'], axis = 1, inplace = True)
-duplicated_trials.drop_duplicates(inplace = True)
+    The results are sorted by trial count in descending order (ties are sorted 
+    by description ids).
+    """
+
+    with measure('task_4', 'count'):
+        incidence = sparse.csr_matrix(
+            (np.ones(len(trial_ids), dtype = np.int64), (trial_ids, description_ids)),
+            shape = (len(trials), len(descriptions)))
+        co_occurrence = sparse.triu(incidence.T @ incidence, k = 1).tocoo()
+        order = np.lexsort((co_occurrence.col, co_occurrence.row, -co_occurrence.data))
+    counters['trial classes'] += incidence.nnz
+    counters['class pairs'] += co_occurrence.nnz
+    
+    """
+    Lastly, the result is formatted correctly.
+    """
+    
+    result_df = pd.DataFrame({
+        'description_1': descriptions[co_occurrence.row[order]],
+        'description_2': descriptions[co_occurrence.col[order]],
+        'trial_count': co_occurrence.data[order]})
+    return result_df
 
 """
-In order to count how frequent a pair of drug classes is, the code below visits
-every row in the duplicated_trials dataframe and generates unique pairs of the
-descriptions found on each row and counts them. Every row processed, the pairs
-are updated so that every existing pair's count in the variable counter is
-updated, and if a new pair is encountered, it is added to counter.  
+Beyond pairs, the frequent combinations of any number of drug classes can be 
+mined when ITEMSETS is True. Enumerating every combination of the classes of 
+every trial explodes with the trials that have many classes, so instead the 
+itemsets are grown depth first (Eclat, a vertical variant of Apriori): every 
+class keeps the sorted ids of its trials (a column of the incidence matrix), 
+an itemset is only extended with the classes that come after its last one, 
+and the trials of the extension are the intersection of both lists. An 
+itemset with fewer than MIN_SUPPORT trials is never extended, since none of 
+its supersets can have more trials (the Apriori property), which prunes all 
+the candidates that cannot be frequent. MAX_ITEMSET_SIZE limits the size of 
+the itemsets (None for no limit).
 
-The results are stored and sorted in descending order.
+The trial counts of all the pairs come from the same sparse product as 
+count_pairs(), so no list is intersected to find the frequent pairs. For the 
+same reason, a class is only tried as an extension of an itemset if it forms 
+a frequent pair with the last class of the itemset, and the trials of a pair 
+are only intersected when the pair itself is extended.
+
+The itemsets with at least two classes are saved in 
+Output/Task_4_itemsets_output.json, sorted by trial count in descending order 
+(then by size and description ids). With MIN_SUPPORT = 1 and 
+MAX_ITEMSET_SIZE = 2, they are the pairs of count_pairs().
 """
 
-counter = collections.Counter() 
+ITEMSETS = False
+MIN_SUPPORT = 5
+MAX_ITEMSET_SIZE = None
 
-for row in duplicated_trials['Groups']:
-    row = row.split('|')
-    counter.update(collections.Counter(itertools.combinations(row, 2)))
+def mine_itemsets(trial_lists, pair_supports, min_support = MIN_SUPPORT, 
+                  max_size = MAX_ITEMSET_SIZE):
+    """
+    Finds the frequent itemsets of classes with Eclat.
 
-result = counter.most_common()
+    Parameters
+    ----------
+    trial_lists : List with the sorted trial ids of every class id.
+    pair_supports : Sparse matrix with the number of trials of every pair of 
+                    class ids (only the upper triangle is used).
+    min_support : Minimum number of trials of a frequent itemset.
+    max_size : Maximum number of classes of an itemset (None for no limit).
 
-"""
-Lastly, the result is formatted correctly and saved as a json file.
-"""
+    Returns
+    -------
+    itemsets : List of (class ids, trial count) tuples, including the single 
+               classes.
+    """
+    pairs = sparse.triu(pair_supports, k = 1).tocoo()
+    is_frequent = pairs.data >= min_support
+    partners = {}
+    for item, other, support in sorted(zip(
+            pairs.row[is_frequent].tolist(), pairs.col[is_frequent].tolist(),
+            pairs.data[is_frequent].tolist())):
+        partners.setdefault(item, {})[other] = support
+    itemsets = []
 
-result_df = pd.DataFrame(result, columns = ['pairs', 'trial_count'])
-result_df[['description_1', 'description_2']] = pd.DataFrame(
-    result_df['pairs'].to_list())
-result_df.drop(['pairs'], axis = 1, inplace = True)
-result_df = result_df[['description_1', 'description_2', 'trial_count']]
+    def extend(prefix, prefix_trials, candidates):
+        for position, (item, trials, support) in enumerate(candidates):
+            itemset = prefix + [item]
+            itemsets.append((itemset, support))
+            if max_size is not None and len(itemset) >= max_size:
+                continue
+            others = [x for x in candidates[position+1:] 
+                      if x[0] in partners.get(item, {})]
+            if not others:
+                continue
+            if trials is None:
+                trials = np.intersect1d(prefix_trials, trial_lists[item], 
+                                        assume_unique = True)
+            extensions = []
+            for other, other_trials, other_support in others:
+                shared = np.intersect1d(
+                    trials, trial_lists[other] if other_trials is None 
+                    else other_trials, assume_unique = True)
+                if len(shared) >= min_support:
+                    extensions.append((other, shared, len(shared)))
+            counters['itemset candidates'] += len(others)
+            if extensions:
+                extend(itemset, trials, extensions)
 
-parsed = [row.dropna().to_dict() for index,row in result_df.iterrows()]
+    for item, trials in enumerate(trial_lists):
+        if len(trials) < min_support:
+            continue
+        itemsets.append(([item], len(trials)))
+        if max_size is not None and max_size < 2:
+            continue
+        extend([item], trials, [(other, None, support) for other, support in 
+                                partners.get(item, {}).items()])
+    return itemsets
 
-with open('Output/Task_4_output.json', 'w') as json_file:
-    json.dump(parsed, json_file, indent = 4)  
+def find_itemsets(task_3, min_support = MIN_SUPPORT, 
+                  max_size = MAX_ITEMSET_SIZE):
+    """
+    Runs the itemset mining on the output of task 3.
+
+    Parameters
+    ----------
+    task_3 : Dataframe with the description, type and list of trials of 
+             every usan code.
+    min_support : Minimum number of trials of a frequent itemset.
+    max_size : Maximum number of classes of an itemset (None for no limit).
+
+    Returns
+    -------
+    itemsets_df : Dataframe with the descriptions, size and trial count of 
+                  every frequent itemset of at least two drug classes.
+    """
+    trial_ids, description_ids, trials, descriptions = \
+        get_trial_descriptions(task_3)
+    incidence = sparse.csc_matrix(
+        (np.ones(len(trial_ids), dtype = np.int64), (trial_ids, description_ids)),
+        shape = (len(trials), len(descriptions)))
+    incidence.sort_indices()
+    trial_lists = [incidence.indices[incidence.indptr[i]:incidence.indptr[i+1]]
+                   for i in range(len(descriptions))]
+    
+    itemsets = [x for x in mine_itemsets(trial_lists, incidence.T @ incidence, 
+                                         min_support, max_size) 
+                if len(x[0]) > 1]
+    itemsets.sort(key = lambda x: (-x[1], len(x[0]), x[0]))
+    counters['frequent itemsets'] += len(itemsets)
+    
+    itemsets_df = pd.DataFrame({
+        'descriptions': [descriptions[x[0]].tolist() for x in itemsets],
+        'size': [len(x[0]) for x in itemsets],
+        'trial_count': [x[1] for x in itemsets]}, 
+        columns = ['descriptions', 'size', 'trial_count'])
+    return itemsets_df
+
+if __name__ == '__main__':
+    with measure('task_4', 'load'):
+        task_3 = read_output(find_output_file('Task_3'))
+    result_df = count_pairs(task_3)
+    with measure('task_4', 'serialize'):
+        write_output(result_df, get_output_file('Task_4'))
+    
+    if ITEMSETS:
+        with measure('task_4', 'itemsets'):
+            itemsets_df = find_itemsets(task_3)
+        with measure('task_4', 'serialize'):
+            write_output(itemsets_df, get_output_file('Task_4_itemsets'))
+    write_metrics('Output/Task_4_metrics.json')
 
 """
 Notes and assumptions:
@@ -0,0 +1,76 @@
+import collections
+
+"""
+A small Aho-Corasick automaton used to find every occurrence of a set of
+patterns in a string with a single pass over its characters.
+
+The automaton is stored as plain lists indexed by node: the goto transitions
+(one dictionary per node), the failure links, and the ids of the patterns
+that end at each node (including those reached through the failure links).
+Node 0 is the root.
+"""
+
+def build_automaton(patterns):
+    """
+    Builds the automaton for a list of patterns.
+
+    Parameters
+    ----------
+    patterns : List of non-empty pattern strings. Their position in the list
+               is used as their id.
+
+    Returns
+    -------
+    automaton : Tuple (goto, fail, output, lengths) to be passed to
+                find_all().
+    """
+    goto = [{}]
+    output = [[]]
+    lengths = []
+    for pattern_id, pattern in enumerate(patterns):
+        node = 0
+        for char in pattern:
+            child = goto[node].get(char)
+            if child is None:
+                child = len(goto)
+                goto[node][char] = child
+                goto.append({})
+                output.append([])
+            node = child
+        output[node].append(pattern_id)
+        lengths.append(len(pattern))
+
+    fail = [0]*len(goto)
+    queue = collections.deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for char, child in goto[node].items():
+            queue.append(child)
+            state = fail[node]
+            while state and char not in goto[state]:
+                state = fail[state]
+            fail[child] = goto[state].get(char, 0)
+            output[child] = output[child] + output[fail[child]]
+    return goto, fail, output, lengths
+
+def find_all(automaton, text):
+    """
+    Finds all occurrences of the patterns in a string.
+
+    Parameters
+    ----------
+    automaton : Output of build_automaton().
+    text : String to be searched.
+
+    Yields
+    ------
+    (start, pattern_id) tuples for every occurrence, ordered by end position.
+    """
+    goto, fail, output, lengths = automaton
+    node = 0
+    for end, char in enumerate(text, 1):
+        while node and char not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(char, 0)
+        for pattern_id in output[node]:
+            yield end - lengths[pattern_id], pattern_id
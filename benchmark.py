@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from synthetic_data import write_synthetic_data
+
+"""
+This script benchmarks the four tasks on synthetic data (see
+synthetic_data.py) at several scales. Each task is run as its own process in
+the data directory, exactly as it is run from the terminal, and the wall time,
+CPU time and peak memory (maximum resident set size) of that process are
+recorded. Task 1's match cache is removed before it runs, so that every run
+does the full matching.
+
+The results are written as a json file with one entry per scale and task. If
+a baseline results file is given, the tasks that became slower than the
+baseline by more than the tolerance factor are reported and the script exits
+with an error, so a regression in one task does not go unnoticed.
+
+    python benchmark.py [--scales 1 10 100] [--output benchmark_results.json]
+                        [--baseline old_results.json] [--tolerance 1.5]
+"""
+
+TASKS = ['Task_1_completed.py', 'Task_2_completed.py', 'Task_3_completed.py',
+         'Task_4_completed.py']
+DATA_DIR = 'bench_data'
+
+def run_task(script, data_dir):
+    """
+    Runs a task script in a data directory and measures it.
+
+    Parameters
+    ----------
+    script : Path of the task script.
+    data_dir : Directory with the input files.
+
+    Returns
+    -------
+    dict
+        Wall time and CPU time in seconds, and peak memory in MB.
+    """
+    start_time = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script], cwd = data_dir,
+                               stdout = subprocess.DEVNULL)
+    pid, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode:
+        raise RuntimeError('{} failed in {}'.format(script, data_dir))
+    return {'wall_seconds': round(wall_time, 3),
+            'cpu_seconds': round(usage.ru_utime + usage.ru_stime, 3),
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1)}
+
+def run_benchmark(scales, data_dir = DATA_DIR, seed = 0):
+    """
+    Generates the synthetic data of every scale and runs the four tasks on it.
+
+    Parameters
+    ----------
+    scales : List of scales.
+    data_dir : Directory where the data of every scale is generated.
+    seed : Seed of the synthetic data.
+
+    Returns
+    -------
+    results : List of dictionaries with the scale, task and measurements.
+    """
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for scale in scales:
+        scale_dir = os.path.join(data_dir, 'scale_{}'.format(scale))
+        write_synthetic_data(scale_dir, scale, seed)
+        os.makedirs(os.path.join(scale_dir, 'Output'), exist_ok = True)
+        if os.path.exists(os.path.join(scale_dir, 'match_cache.sqlite')):
+            os.remove(os.path.join(scale_dir, 'match_cache.sqlite'))
+
+        for task in TASKS:
+            result = {'scale': scale, 'task': task.split('_completed')[0]}
+            result.update(run_task(os.path.join(source_dir, task), scale_dir))
+            print('scale {scale}, {task}: {wall_seconds} s, '
+                  '{peak_rss_mb} MB'.format(**result))
+            results.append(result)
+    return results
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compares the results with a baseline.
+
+    Parameters
+    ----------
+    results : Output of run_benchmark().
+    baseline : Results of a previous run.
+    tolerance : Factor by which a task can be slower than the baseline.
+
+    Returns
+    -------
+    list
+        Descriptions of the tasks slower than the baseline times tolerance.
+    """
+    previous = {(x['scale'], x['task']): x['wall_seconds'] for x in baseline}
+    regressions = []
+    for result in results:
+        key = (result['scale'], result['task'])
+        if key in previous and (result['wall_seconds'] >
+                                previous[key] * tolerance):
+            regressions.append('scale {}, {}: {} s (baseline {} s)'.format(
+                key[0], key[1], result['wall_seconds'], previous[key]))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Benchmarks the four tasks on synthetic data.')
+    parser.add_argument('--scales', type = int, nargs = '+', default = [1])
+    parser.add_argument('--data-dir', default = DATA_DIR)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = 'benchmark_results.json')
+    parser.add_argument('--baseline', help = 'results file to compare with')
+    parser.add_argument('--tolerance', type = float, default = 1.5)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.scales, args.data_dir, args.seed)
+    with open(args.output, 'w') as json_file:
+        json.dump(results, json_file, indent = 4)
+
+    if args.baseline:
+        with open(args.baseline) as json_file:
+            regressions = find_regressions(results, json.load(json_file),
+                                           args.tolerance)
+        if regressions:
+            sys.exit('Regressions found:\n' + '\n'.join(regressions))
@@ -0,0 +1,49 @@
+import pandas as pd
+import argparse
+
+import Task_1_completed
+import Task_2_completed
+from drug_dictionary import DICTIONARY_FILE, open_dictionary, write_dictionary
+
+"""
+Compiles drugs.csv and usan_stems.csv into the binary dictionary read by
+drug_dictionary.py. The drug names are cleaned with the code of task 1 and
+the usan stems file is read with the code of task 2, so the compiled file has
+the same content the tasks would build from the csv files:
+
+    python compile_dictionary.py [--drugs drugs.csv] [--stems usan_stems.csv]
+                                 [--output drug_dictionary.bin]
+"""
+
+def compile_dictionary(drugs, usan_stem, dictionary_file = DICTIONARY_FILE):
+    """
+    Writes the compiled dictionary of the drugs and usan stems.
+
+    Parameters
+    ----------
+    drugs : Drugs dataframe, as read from drugs.csv.
+    usan_stem : Output of Task_2_completed.read_usan_stems().
+    dictionary_file : Path of the compiled file.
+
+    Returns
+    -------
+    None.
+    """
+    write_dictionary(drugs['itemLabel'].tolist(),
+                     Task_1_completed.get_drug_names(drugs), usan_stem,
+                     dictionary_file)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Compiles the drugs and usan stems files.')
+    parser.add_argument('--drugs', default = 'drugs.csv')
+    parser.add_argument('--stems', default = 'usan_stems.csv')
+    parser.add_argument('--output', default = DICTIONARY_FILE)
+    args = parser.parse_args()
+
+    compile_dictionary(pd.read_csv(args.drugs),
+                       Task_2_completed.read_usan_stems(args.stems),
+                       args.output)
+    dictionary = open_dictionary(args.output)
+    print('Compiled {} drugs and {} usan stems rows into {}'.format(
+        len(dictionary['names']), len(dictionary['stems']), args.output))
@@ -0,0 +1,196 @@
+import pandas as pd
+import numpy as np
+import os
+
+"""
+Compiled binary version of drugs.csv and usan_stems.csv, so that the scripts
+and the matcher processes do not have to parse both files (and clean every
+drug name) each time they start. The file is written by compile_dictionary.py,
+and this module only reads it, so the tasks can import it without importing
+each other.
+
+The file holds three string tables: the primary names of the drugs as they
+are in drugs.csv (used by task 2), the cleaned names of every drug (the
+output of Task_1_completed.get_drug_names(), primary name first) and the
+cells of every row of usan_stems.csv (the output of
+Task_2_completed.read_usan_stems()). A string table is an array of offsets
+followed by the utf-8 bytes of all its strings, one after the other, so
+string i is blob[offsets[i]:offsets[i+1]]. The names and the cells are
+grouped by drug and by row with an array of starts, in the same way.
+
+    MAGIC | offset and size of every section (uint64) | sections
+
+The file is a cache of the parsed and cleaned csv files, nothing more: 
+opening it decodes the string tables back into the same lists the tasks would 
+build from the csv files, without running pandas, the trademark replacement 
+or the csv reader. The matching indexes of Task 1 and the stem index of 
+Task 2 are still built from these lists by every process that uses them.
+"""
+
+DICTIONARY_FILE = 'drug_dictionary.bin'
+MAGIC = b'MZDRUGS1'
+SECTIONS = ['label_offsets', 'label_blob', 'name_offsets', 'name_blob',
+            'name_starts', 'cell_offsets', 'cell_blob', 'row_starts']
+
+def encode_strings(strings):
+    """
+    Encodes a list of strings as a string table.
+
+    Parameters
+    ----------
+    strings : List of strings.
+
+    Returns
+    -------
+    offsets : Array with the start of every string in the blob, and its end.
+    blob : utf-8 bytes of all the strings.
+    """
+    encoded = [x.encode('utf-8') for x in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype = '<u8')
+    np.cumsum(list(map(len, encoded)), out = offsets[1:])
+    return offsets, b''.join(encoded)
+
+def get_starts(groups):
+    """Returns the start of every group of a list of lists, and its end."""
+    starts = np.zeros(len(groups) + 1, dtype = '<u8')
+    np.cumsum(list(map(len, groups)), out = starts[1:])
+    return starts
+
+def write_dictionary(labels, drugs_names, usan_stem,
+                     dictionary_file = DICTIONARY_FILE):
+    """
+    Writes the compiled dictionary of the drugs and usan stems.
+
+    Parameters
+    ----------
+    labels : List with the primary name of every drug, as in drugs.csv.
+    drugs_names : Output of Task_1_completed.get_drug_names().
+    usan_stem : Output of Task_2_completed.read_usan_stems().
+    dictionary_file : Path of the compiled file.
+
+    Returns
+    -------
+    None.
+    """
+    sections = dict(zip(['label_offsets', 'label_blob'],
+                        encode_strings(labels)))
+    sections.update(zip(['name_offsets', 'name_blob'],
+                        encode_strings([j for i in drugs_names for j in i])))
+    sections['name_starts'] = get_starts(drugs_names)
+    sections.update(zip(['cell_offsets', 'cell_blob'],
+                        encode_strings([j for i in usan_stem for j in i])))
+    sections['row_starts'] = get_starts(usan_stem)
+
+    """
+    Every section starts at a multiple of 8 bytes, so that the arrays can be
+    viewed in place. The file is written next to the old one and then renamed
+    over it, so a half written file is never read.
+    """
+
+    header = np.zeros(2 * len(SECTIONS), dtype = '<u8')
+    position = len(MAGIC) + header.nbytes
+    chunks = []
+    for i, name in enumerate(SECTIONS):
+        data = sections[name]
+        data = data if isinstance(data, bytes) else data.tobytes()
+        padding = -position % 8
+        chunks.append(b'\0' * padding + data)
+        header[2*i:2*i+2] = position + padding, len(data)
+        position += padding + len(data)
+
+    temporary_file = dictionary_file + '.tmp'
+    with open(temporary_file, 'wb') as file:
+        file.write(MAGIC)
+        file.write(header.tobytes())
+        for chunk in chunks:
+            file.write(chunk)
+    os.replace(temporary_file, dictionary_file)
+
+def decode_strings(offsets, blob):
+    """
+    Decodes the strings of a string table.
+
+    Parameters
+    ----------
+    offsets : Array of offsets, as built by encode_strings().
+    blob : utf-8 bytes of all the strings.
+
+    Returns
+    -------
+    list
+        Strings.
+    """
+    blob = bytes(blob)
+    offsets = offsets.tolist()
+    return [blob[offsets[i]:offsets[i+1]].decode('utf-8')
+            for i in range(len(offsets) - 1)]
+
+def split_groups(strings, starts):
+    """Splits a list of strings into the groups given by an array of starts."""
+    starts = starts.tolist()
+    return [strings[starts[i]:starts[i+1]] for i in range(len(starts) - 1)]
+
+opened = {}
+
+def open_dictionary(dictionary_file = DICTIONARY_FILE):
+    """
+    Reads a compiled dictionary. A file is only read once per process, until 
+    it is replaced: the lists of the old file are then dropped.
+
+    Parameters
+    ----------
+    dictionary_file : Path of the compiled file.
+
+    Returns
+    -------
+    dictionary : Dictionary with the primary names of the drugs as in
+                 drugs.csv ('labels'), the cleaned names of every drug
+                 ('names') and the rows of the usan stems file ('stems').
+    """
+    path = os.path.abspath(dictionary_file)
+    mtime = os.stat(dictionary_file).st_mtime_ns
+    if path in opened and opened[path][0] == mtime:
+        return opened[path][1]
+    opened.pop(path, None)
+
+    with open(dictionary_file, 'rb') as file:
+        buffer = memoryview(file.read())
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a compiled dictionary: {}'.format(
+            dictionary_file))
+    header = np.frombuffer(buffer, dtype = '<u8', count = 2 * len(SECTIONS),
+                           offset = len(MAGIC))
+    sections = {}
+    for i, name in enumerate(SECTIONS):
+        start, size = int(header[2*i]), int(header[2*i+1])
+        sections[name] = buffer[start:start+size]
+    for name in SECTIONS:
+        if not name.endswith('_blob'):
+            sections[name] = np.frombuffer(sections[name], dtype = '<u8')
+
+    dictionary = {
+        'labels': decode_strings(sections['label_offsets'],
+                                 sections['label_blob']),
+        'names': split_groups(decode_strings(sections['name_offsets'],
+                                             sections['name_blob']),
+                              sections['name_starts']),
+        'stems': split_groups(decode_strings(sections['cell_offsets'],
+                                             sections['cell_blob']),
+                              sections['row_starts'])}
+    opened[path] = (mtime, dictionary)
+    return dictionary
+
+def get_drugs(dictionary):
+    """
+    Builds the drugs dataframe used by task 2 (primary names only).
+
+    Parameters
+    ----------
+    dictionary : Output of open_dictionary().
+
+    Returns
+    -------
+    Dataframe
+        Dataframe with the itemLabel column of drugs.csv.
+    """
+    return pd.DataFrame({'itemLabel': list(dictionary['labels'])})
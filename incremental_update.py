@@ -0,0 +1,393 @@
+import pandas as pd
+import argparse
+import collections
+import itertools
+import json
+import sqlite3
+
+import Task_3_completed
+import Task_4_completed
+from match_cache import get_fingerprint
+from outputs import (find_output_file, get_output_file, read_output, 
+                     write_output)
+from instrumentation import counters, measure, write_metrics
+
+"""
+Incremental version of tasks 3 and 4, for when only a few trials are matched,
+changed or dropped since the last run. Instead of grouping every trial again,
+the added and removed trial records (rows of the task 1 output) are applied to
+a state kept in an SQLite file:
+
+  - The usan code rows of task 3 and the (drug, row) pairs that join them
+    with the trials, taken from the task 2 output when the state is built.
+  - The current trial records, numbered in the order they were added.
+  - The entries of the trials list of every row, as (row, record number,
+    position of the drug in the record, nct_id). Sorting them gives the trials
+    lists of group_trials() on the current records, since a new record is
+    appended after all the others and the order of the rest does not change
+    when a record is removed.
+  - The number of entries of every (nct_id, drug class), i.e. the classes of
+    every trial, and the number of trials of every pair of classes.
+
+When a record is added or removed, only its entries are inserted or deleted.
+The classes of its nct_id are compared before and after the change, and the
+count of every pair that appeared or disappeared from the trial goes up or
+down by one, so the pair counts of count_pairs() are kept without recounting.
+
+If the task 2 output changed since the state was built, every row may join
+different trials, so the state is rebuilt from the stored records first.
+verify_state() runs the full tasks 3 and 4 on the stored records and checks
+that they give the same results as the state.
+
+    python incremental_update.py init
+    python incremental_update.py update [--added records.json]
+                                        [--removed records.json]
+    python incremental_update.py verify
+"""
+
+STATE_FILE = 'incremental_state.sqlite'
+
+def open_state(state_file = STATE_FILE):
+    """
+    Opens (or creates) the state file.
+
+    Parameters
+    ----------
+    state_file : Path of the SQLite file.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the state.
+    """
+    connection = sqlite3.connect(state_file)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS descriptions (
+            row INTEGER PRIMARY KEY, description TEXT, type TEXT,
+            class_id INTEGER);
+        CREATE TABLE IF NOT EXISTS edges (drug TEXT, row INTEGER);
+        CREATE TABLE IF NOT EXISTS trials (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT, nct_id TEXT, drugs TEXT);
+        CREATE INDEX IF NOT EXISTS trials_record ON trials (nct_id, drugs);
+        CREATE TABLE IF NOT EXISTS entries (
+            row INTEGER, seq INTEGER, position INTEGER, nct_id TEXT);
+        CREATE INDEX IF NOT EXISTS entries_order ON entries (
+            row, seq, position);
+        CREATE INDEX IF NOT EXISTS entries_seq ON entries (seq);
+        CREATE TABLE IF NOT EXISTS trial_classes (
+            nct_id TEXT, class_id INTEGER, count INTEGER,
+            PRIMARY KEY (nct_id, class_id));
+        CREATE TABLE IF NOT EXISTS pairs (
+            class_1 INTEGER, class_2 INTEGER, trial_count INTEGER,
+            PRIMARY KEY (class_1, class_2));
+        ''')
+    return connection
+
+def get_task_2_fingerprint(task_2):
+    """Hashes the drugs and usan codes of the task 2 output."""
+    return get_fingerprint(task_2.iloc[:,0].tolist(), task_2.iloc[:,1].tolist())
+
+def build_state(connection, task_1, task_2):
+    """
+    Replaces the state with the one of the outputs of tasks 1 and 2.
+
+    Parameters
+    ----------
+    connection : Output of open_state().
+    task_1 : Dataframe with the nct_id and drugs of every matched trial.
+    task_2 : Dataframe with the drug name and usan codes of every drug.
+
+    Returns
+    -------
+    None.
+    """
+    extended_df, drug_names = Task_3_completed.get_descriptions(task_2)
+    class_ids, classes = pd.factorize(
+        extended_df['description'].where(extended_df['type'] == 'class'))
+
+    with connection:
+        for table in ['meta', 'descriptions', 'edges', 'trials', 'entries',
+                      'trial_classes', 'pairs']:
+            connection.execute('DELETE FROM {}'.format(table))
+        connection.execute("DELETE FROM sqlite_sequence WHERE name = 'trials'")
+        connection.execute('INSERT INTO meta VALUES (?, ?)',
+                           ('task_2', get_task_2_fingerprint(task_2)))
+        connection.executemany(
+            'INSERT INTO descriptions VALUES (?, ?, ?, ?)',
+            [(row, description, usan_type,
+              int(class_id) if class_id >= 0 else None)
+             for row, (description, usan_type, class_id) in enumerate(zip(
+                 extended_df['description'], extended_df['type'], class_ids))])
+        connection.executemany(
+            'INSERT INTO edges VALUES (?, ?)',
+            [(drug_names[drug_id], row)
+             for row, drugs in enumerate(extended_df['drugs'])
+             for drug_id in drugs])
+    apply_delta(connection, task_1)
+
+def get_entries(drugs, drug_rows):
+    """
+    Lists the trials list entries of a trial record.
+
+    Parameters
+    ----------
+    drugs : List of drugs of the record.
+    drug_rows : Dictionary with the rows joined by every drug.
+
+    Returns
+    -------
+    list
+        (row, position of the drug) tuples.
+    """
+    return [(row, position) for position, drug in enumerate(drugs)
+            for row in drug_rows.get(drug, [])]
+
+def get_trial_classes(connection, nct_ids):
+    """Returns the set of class ids of every nct_id."""
+    return {nct_id: {x for x, in connection.execute(
+                'SELECT class_id FROM trial_classes WHERE nct_id = ?',
+                (nct_id,))}
+            for nct_id in nct_ids}
+
+def apply_delta(connection, added = None, removed = None):
+    """
+    Applies added and removed trial records to the state. Nothing is applied
+    if a removed record is not in the state. The columns are selected by 
+    name, so an empty output of task 1 (read back without columns) is no 
+    change.
+
+    Parameters
+    ----------
+    connection : Output of open_state().
+    added : Dataframe with the nct_id and drugs of the new records, or None.
+    removed : Dataframe with the nct_id and drugs of the removed records, or
+              None. Each row removes one identical stored record.
+
+    Returns
+    -------
+    None.
+    """
+    drug_rows = {}
+    for drug, row in connection.execute(
+            'SELECT drug, row FROM edges ORDER BY rowid'):
+        drug_rows.setdefault(drug, []).append(row)
+    class_ids = dict(connection.execute(
+        'SELECT row, class_id FROM descriptions WHERE class_id IS NOT NULL'))
+
+    changes = collections.Counter()
+    with connection:
+        if removed is not None:
+            removed = removed.reindex(columns = ['nct_id', 'drugs'])
+            for nct_id, drugs in zip(removed['nct_id'], removed['drugs']):
+                record = (nct_id, json.dumps(list(drugs)))
+                found = connection.execute(
+                    'SELECT seq FROM trials WHERE nct_id = ? AND drugs = ? '
+                    'ORDER BY seq LIMIT 1', record).fetchone()
+                if found is None:
+                    raise KeyError('unknown trial record: {} {}'.format(*record))
+                connection.execute('DELETE FROM trials WHERE seq = ?', found)
+                connection.execute('DELETE FROM entries WHERE seq = ?', found)
+                for row, position in get_entries(drugs, drug_rows):
+                    if row in class_ids:
+                        changes[nct_id, class_ids[row]] -= 1
+            counters['trial records removed'] += len(removed)
+
+        if added is not None:
+            added = added.reindex(columns = ['nct_id', 'drugs'])
+            for nct_id, drugs in zip(added['nct_id'], added['drugs']):
+                seq = connection.execute(
+                    'INSERT INTO trials (nct_id, drugs) VALUES (?, ?)',
+                    (nct_id, json.dumps(list(drugs)))).lastrowid
+                entries = get_entries(drugs, drug_rows)
+                connection.executemany(
+                    'INSERT INTO entries VALUES (?, ?, ?, ?)',
+                    [(row, seq, position, nct_id)
+                     for row, position in entries])
+                for row, position in entries:
+                    if row in class_ids:
+                        changes[nct_id, class_ids[row]] += 1
+            counters['trial records added'] += len(added)
+
+        update_pairs(connection, changes)
+
+def update_pairs(connection, changes):
+    """
+    Updates the classes of the changed trials and the pair counts.
+
+    Parameters
+    ----------
+    connection : Output of open_state().
+    changes : Counter with the change of the number of entries of every
+              (nct_id, class id).
+
+    Returns
+    -------
+    None.
+    """
+    nct_ids = {nct_id for nct_id, class_id in changes}
+    old_classes = get_trial_classes(connection, nct_ids)
+    connection.executemany(
+        'INSERT INTO trial_classes VALUES (?, ?, ?) '
+        'ON CONFLICT (nct_id, class_id) '
+        'DO UPDATE SET count = count + excluded.count',
+        [(nct_id, class_id, change)
+         for (nct_id, class_id), change in changes.items() if change])
+    connection.execute('DELETE FROM trial_classes WHERE count = 0')
+    new_classes = get_trial_classes(connection, nct_ids)
+
+    pair_changes = collections.Counter()
+    for nct_id in nct_ids:
+        for pair in itertools.combinations(sorted(old_classes[nct_id]), 2):
+            pair_changes[pair] -= 1
+        for pair in itertools.combinations(sorted(new_classes[nct_id]), 2):
+            pair_changes[pair] += 1
+    pair_changes = [(class_1, class_2, change)
+                    for (class_1, class_2), change in pair_changes.items()
+                    if change]
+    connection.executemany(
+        'INSERT INTO pairs VALUES (?, ?, ?) '
+        'ON CONFLICT (class_1, class_2) '
+        'DO UPDATE SET trial_count = trial_count + excluded.trial_count',
+        pair_changes)
+    connection.execute('DELETE FROM pairs WHERE trial_count = 0')
+    counters['pair counts changed'] += len(pair_changes)
+
+def update_state(connection, task_2, added = None, removed = None):
+    """
+    Applies added and removed trial records, rebuilding the state first if
+    the task 2 output changed since it was built.
+
+    Parameters
+    ----------
+    connection : Output of open_state().
+    task_2 : Dataframe with the drug name and usan codes of every drug.
+    added : Dataframe with the nct_id and drugs of the new records, or None.
+    removed : Dataframe with the nct_id and drugs of the removed records, or
+              None.
+
+    Returns
+    -------
+    bool
+        True if the state was rebuilt.
+    """
+    stored = connection.execute(
+        "SELECT value FROM meta WHERE key = 'task_2'").fetchone()
+    rebuilt = stored != (get_task_2_fingerprint(task_2),)
+    if rebuilt:
+        build_state(connection, get_task_1(connection), task_2)
+    apply_delta(connection, added, removed)
+    return rebuilt
+
+def get_task_1(connection):
+    """
+    Reads the stored trial records, in the order they were added.
+
+    Returns
+    -------
+    Dataframe
+        Dataframe with the nct_id and drugs of every record.
+    """
+    records = connection.execute(
+        'SELECT nct_id, drugs FROM trials ORDER BY seq').fetchall()
+    return pd.DataFrame({'nct_id': [x[0] for x in records],
+                         'drugs': [json.loads(x[1]) for x in records]},
+                        columns = ['nct_id', 'drugs'])
+
+def get_task_3(connection):
+    """
+    Reads the trials lists of the state.
+
+    Returns
+    -------
+    Dataframe
+        Same result as Task_3_completed.group_trials() on the stored records.
+    """
+    rows = connection.execute(
+        'SELECT description, type FROM descriptions ORDER BY row').fetchall()
+    trials = [[] for x in rows]
+    for row, nct_id in connection.execute(
+            'SELECT row, nct_id FROM entries ORDER BY row, seq, position'):
+        trials[row].append(nct_id)
+    return pd.DataFrame({'description': [x[0] for x in rows],
+                         'type': [x[1] for x in rows], 'trials': trials},
+                        columns = ['description', 'type', 'trials'])
+
+def get_task_4(connection):
+    """
+    Reads the pair counts of the state.
+
+    Returns
+    -------
+    Dataframe
+        Same result as Task_4_completed.count_pairs() on the output of
+        get_task_3().
+    """
+    classes = dict(connection.execute(
+        'SELECT class_id, description FROM descriptions '
+        'WHERE class_id IS NOT NULL'))
+    pairs = connection.execute(
+        'SELECT class_1, class_2, trial_count FROM pairs '
+        'ORDER BY trial_count DESC, class_1, class_2').fetchall()
+    return pd.DataFrame({
+        'description_1': [classes[x[0]] for x in pairs],
+        'description_2': [classes[x[1]] for x in pairs],
+        'trial_count': [x[2] for x in pairs]},
+        columns = ['description_1', 'description_2', 'trial_count'])
+
+def verify_state(connection, task_2):
+    """
+    Runs the full tasks 3 and 4 on the stored records and compares them with
+    the state.
+
+    Parameters
+    ----------
+    connection : Output of open_state().
+    task_2 : Dataframe with the drug name and usan codes of every drug.
+
+    Returns
+    -------
+    tuple
+        True or False for the task 3 and the task 4 results.
+    """
+    task_3 = Task_3_completed.group_trials(get_task_1(connection), task_2)
+    task_4 = Task_4_completed.count_pairs(task_3)
+    return (task_3.to_dict(orient = 'records') ==
+            get_task_3(connection).to_dict(orient = 'records'),
+            task_4.to_dict(orient = 'records') ==
+            get_task_4(connection).to_dict(orient = 'records'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Updates tasks 3 and 4 with added or removed trials.')
+    parser.add_argument('mode', choices = ['init', 'update', 'verify'])
+    parser.add_argument('--added', default = None,
+                        help = 'file with the added records (task 1 format)')
+    parser.add_argument('--removed', default = None,
+                        help = 'file with the removed records (task 1 format)')
+    parser.add_argument('--state', default = STATE_FILE)
+    args = parser.parse_args()
+
+    connection = open_state(args.state)
+    task_2 = read_output(find_output_file('Task_2'))
+    if args.mode == 'verify':
+        task_3_matches, task_4_matches = verify_state(connection, task_2)
+        print('Task 3: {}, task 4: {}'.format(
+            'same' if task_3_matches else 'DIFFERENT',
+            'same' if task_4_matches else 'DIFFERENT'))
+        parser.exit(0 if task_3_matches and task_4_matches else 1)
+
+    with measure('incremental', 'update'):
+        if args.mode == 'init':
+            build_state(connection, read_output(find_output_file('Task_1')),
+                        task_2)
+        else:
+            if update_state(
+                    connection, task_2,
+                    args.added and read_output(args.added),
+                    args.removed and read_output(args.removed)):
+                print('The task 2 output changed, the state was rebuilt')
+    with measure('incremental', 'serialize'):
+        write_output(get_task_3(connection), get_output_file('Task_3'))
+        write_output(get_task_4(connection), get_output_file('Task_4'))
+    write_metrics('Output/incremental_metrics.json')
@@ -0,0 +1,154 @@
+import collections
+import contextlib
+import cProfile
+import json
+import os
+import resource
+import threading
+import time
+
+"""
+Instrumentation shared by the four tasks and the pipeline. Every task wraps
+its sub-steps (load, normalize, match, serialize...) in measure(), which
+records their wall time, CPU time and memory: the resident set size (RSS) at 
+the start of the step, the peak RSS during the step and its increase over the 
+start. The peak is sampled every SAMPLE_INTERVAL seconds by a thread while the 
+step runs. If the step raised the peak RSS of the process (ru_maxrss), that 
+exact value is used instead, so short spikes are not missed in the step that 
+uses the most memory. The tasks also increment
+domain counters in counters (find_match() calls, extractOne calls, candidates
+pruned, stem matches, rows joined...). write_metrics() saves all of it as a
+json file that can be scraped.
+
+Setting the environment variable in PROFILE_VARIABLE to a directory also runs
+every measured step under cProfile and saves its stats in that directory as
+<stage>_<step>.prof (to be opened with pstats or snakeviz):
+
+    MELLIZYME_PROFILE=profiles python Task_1_completed.py
+"""
+
+PROFILE_VARIABLE = 'MELLIZYME_PROFILE'
+SAMPLE_INTERVAL = 0.01
+
+metrics = collections.defaultdict(dict)
+counters = collections.Counter()
+
+def get_peak_rss():
+    """
+    Returns the maximum resident set size of the process so far, in MB.
+
+    Returns
+    -------
+    float
+        Peak memory in MB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def get_rss():
+    """
+    Returns the current resident set size of the process, in MB (read from 
+    /proc, or the peak so far where it is not available).
+
+    Returns
+    -------
+    float
+        Memory in MB.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except OSError:
+        return get_peak_rss()
+    return pages * resource.getpagesize() / 2**20
+
+@contextlib.contextmanager
+def measure(stage, step):
+    """
+    Context manager recording the wall time, CPU time and memory of a step of 
+    a stage, and profiling it if PROFILE_VARIABLE is set. A step measured 
+    more than once keeps the RSS of its first start and the highest peak and 
+    increase.
+
+    Parameters
+    ----------
+    stage : Name of the stage (e.g. 'task_1').
+    step : Name of the step (e.g. 'match').
+
+    Yields
+    ------
+    None.
+    """
+    profile_dir = os.environ.get(PROFILE_VARIABLE)
+    profiler = None
+    if profile_dir:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start_rss = get_rss()
+    start_peak = get_peak_rss()
+    peak = [start_rss]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], get_rss())
+
+    sampler = threading.Thread(target = sample, daemon = True)
+    sampler.start()
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start_time
+        cpu_time = time.process_time() - start_cpu
+        stop.set()
+        sampler.join()
+        step_peak = max(peak[0], get_rss())
+        if get_peak_rss() > start_peak:
+            step_peak = max(step_peak, get_peak_rss())
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profile_dir, exist_ok = True)
+            profiler.dump_stats(os.path.join(
+                profile_dir, '{}_{}.prof'.format(stage, step)))
+        previous = metrics[stage].get(step, {
+            'wall_seconds': 0, 'cpu_seconds': 0, 
+            'rss_start_mb': round(start_rss, 1), 'peak_rss_mb': 0, 
+            'rss_increase_mb': 0})
+        metrics[stage][step] = {
+            'wall_seconds': round(previous['wall_seconds'] + wall_time, 4),
+            'cpu_seconds': round(previous['cpu_seconds'] + cpu_time, 4),
+            'rss_start_mb': previous['rss_start_mb'],
+            'peak_rss_mb': max(previous['peak_rss_mb'], round(step_peak, 1)),
+            'rss_increase_mb': max(previous['rss_increase_mb'], 
+                                   round(step_peak - start_rss, 1))}
+
+def write_metrics(metrics_file):
+    """
+    Saves the measured steps (plus a total per stage, whose RSS increase is 
+    over the start of its first step) and the counters as a json file.
+
+    Parameters
+    ----------
+    metrics_file : Path of the json file.
+
+    Returns
+    -------
+    None.
+    """
+    stages = {}
+    for stage, steps in metrics.items():
+        stages[stage] = dict(steps)
+        stages[stage]['total'] = {
+            'wall_seconds': round(sum(x['wall_seconds']
+                                      for x in steps.values()), 4),
+            'cpu_seconds': round(sum(x['cpu_seconds']
+                                     for x in steps.values()), 4),
+            'rss_start_mb': next(iter(steps.values()))['rss_start_mb'],
+            'peak_rss_mb': max(x['peak_rss_mb'] for x in steps.values())}
+        stages[stage]['total']['rss_increase_mb'] = round(
+            stages[stage]['total']['peak_rss_mb'] - 
+            stages[stage]['total']['rss_start_mb'], 1)
+    with open(metrics_file, 'w') as json_file:
+        json.dump({'stages': stages, 'counters': dict(counters)}, json_file,
+                  indent = 4)
@@ -0,0 +1,238 @@
+import pandas as pd
+import argparse
+import collections
+import http.server
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+import Task_1_completed
+import Task_2_completed
+import drug_dictionary
+
+"""
+This script keeps the Task 1 matcher and the Task 2 stem classifier loaded in
+a resident process, so that new intervention_names can be tagged as they
+arrive instead of rerunning the batch. The drug names, their indexes and the
+usan codes of every drug are built once at startup. A query is an
+intervention_name string, and its answer lists the matched primary drug names
+with their usan codes (description and type), in drug order:
+
+    {"intervention_name": "labetalol 10 mg", "drugs": [
+        {"drug": "labetalol", "usan_codes": [
+            {"description": "combined alpha and beta blockers",
+             "type": "class"}]}]}
+
+The answers of the last CACHE_SIZE distinct queries are kept in an LRU cache.
+The drugs and usan stems files are checked (modification time) at most every
+RELOAD_INTERVAL seconds, and when one of them changed, the dictionaries are
+rebuilt and the cache emptied. A reload can also be forced. With --dictionary,
+the drugs and usan stems are read from a file compiled by drug_dictionary.py
+(which is watched instead), so the files are not parsed again at every start
+or reload.
+
+It can run as a local HTTP server, answering GET /match?q=<intervention_name>
+(and POST /reload), or read one intervention_name per line from stdin and
+write one json answer per line:
+
+    python lookup_service.py serve [--port 8765] [--drugs drugs.csv]
+                                   [--stems usan_stems.csv]
+    python lookup_service.py query [--drugs drugs.csv] [--stems usan_stems.csv]
+    python lookup_service.py serve|query --dictionary drug_dictionary.bin
+"""
+
+CACHE_SIZE = 100000
+RELOAD_INTERVAL = 5
+PORT = 8765
+
+service = {}
+
+def get_mtimes(*files):
+    """Returns the modification times of the files that are not None."""
+    return tuple(os.path.getmtime(x) for x in files if x is not None)
+
+def load_service(drugs_file = 'drugs.csv', stems_file = 'usan_stems.csv',
+                 dictionary_file = None):
+    """
+    Builds the dictionaries of the service from the drugs and usan stems files
+    (or from a compiled dictionary) and empties its cache.
+
+    Parameters
+    ----------
+    drugs_file : Path of the drugs csv file.
+    stems_file : Path of the usan stems csv file.
+    dictionary_file : Path of a file compiled by drug_dictionary.py, used
+                      instead of the csv files if given.
+
+    Returns
+    -------
+    None.
+    """
+    if dictionary_file is None:
+        files = (drugs_file, stems_file, None)
+        mtimes = get_mtimes(*files)
+        drugs = pd.read_csv(drugs_file)
+        drugs_names = Task_1_completed.get_drug_names(drugs)
+        usan_stem = Task_2_completed.read_usan_stems(stems_file)
+    else:
+        files = (None, None, dictionary_file)
+        mtimes = get_mtimes(*files)
+        dictionary = drug_dictionary.open_dictionary(dictionary_file)
+        drugs = drug_dictionary.get_drugs(dictionary)
+        drugs_names = dictionary['names']
+        usan_stem = list(dictionary['stems'])
+    indexes = Task_1_completed.build_matching_indexes(drugs_names)
+
+    drugs_trimmed = Task_2_completed.classify_drugs(drugs, usan_stem)
+    drug_codes = {}
+    for idx, usan_codes in drugs_trimmed['usan_codes'].items():
+        drug_codes.setdefault(drugs_names[idx][0], usan_codes)
+
+    service.update({'files': files, 'mtimes': mtimes,
+                    'checked': time.monotonic(), 'drugs_names': drugs_names,
+                    'indexes': indexes, 'drug_codes': drug_codes,
+                    'cache': collections.OrderedDict()})
+
+def check_reload():
+    """
+    Reloads the service if the drugs or usan stems file (or the compiled
+    dictionary) changed since it was loaded (checked at most every RELOAD_INTERVAL seconds).
+
+    Returns
+    -------
+    bool
+        True if the service was reloaded.
+    """
+    if time.monotonic() - service['checked'] < RELOAD_INTERVAL:
+        return False
+    service['checked'] = time.monotonic()
+    if get_mtimes(*service['files']) == service['mtimes']:
+        return False
+    load_service(*service['files'])
+    return True
+
+def lookup(notes):
+    """
+    Matches an intervention_name against the loaded drugs and classifies the
+    matched drugs.
+
+    Parameters
+    ----------
+    notes : intervention_name string.
+
+    Returns
+    -------
+    dict
+        The intervention_name and the list of matched drugs, each with its
+        usan codes.
+    """
+    check_reload()
+    cache = service['cache']
+    if notes in cache:
+        cache.move_to_end(notes)
+        return cache[notes]
+
+    matches = Task_1_completed.match_distinct(
+        [notes.replace('®', '').replace('™', '')], service['drugs_names'],
+        service['indexes'])[0]
+    answer = {'intervention_name': notes,
+              'drugs': [{'drug': x,
+                         'usan_codes': service['drug_codes'].get(x, [])}
+                        for x in matches]}
+    cache[notes] = answer
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last = False)
+    return answer
+
+class LookupHandler(http.server.BaseHTTPRequestHandler):
+    """Answers GET /match?q=<intervention_name> and POST /reload."""
+
+    def send_json(self, status, content):
+        """Sends a json response."""
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Answers a query."""
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path != '/match' or 'q' not in query:
+            self.send_json(404, {'error': 'use /match?q=<intervention_name>'})
+            return
+        self.send_json(200, lookup(query['q'][0]))
+
+    def do_POST(self):
+        """Forces a reload of the dictionaries."""
+        if self.path != '/reload':
+            self.send_json(404, {'error': 'use /reload'})
+            return
+        load_service(*service['files'])
+        self.send_json(200, {'reloaded': True,
+                             'drugs': len(service['drugs_names'])})
+
+    def log_message(self, format, *args):
+        """Does not log every request."""
+        pass
+
+def serve(port = PORT):
+    """
+    Answers the queries of a local HTTP server until it is interrupted.
+
+    Parameters
+    ----------
+    port : Port of the server (on localhost).
+
+    Returns
+    -------
+    None.
+    """
+    server = http.server.HTTPServer(('127.0.0.1', port), LookupHandler)
+    print('Serving on http://127.0.0.1:{}/match?q='.format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+def answer_lines(infile = sys.stdin, outfile = sys.stdout):
+    """
+    Answers one intervention_name per line of infile with one json line.
+
+    Parameters
+    ----------
+    infile : File with one intervention_name per line.
+    outfile : File where the answers are written.
+
+    Returns
+    -------
+    None.
+    """
+    for line in infile:
+        notes = line.rstrip('\n')
+        if notes:
+            outfile.write(json.dumps(lookup(notes)) + '\n')
+            outfile.flush()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Matches and classifies intervention_names on demand.')
+    parser.add_argument('mode', choices = ['serve', 'query'])
+    parser.add_argument('--drugs', default = 'drugs.csv')
+    parser.add_argument('--stems', default = 'usan_stems.csv')
+    parser.add_argument('--dictionary', default = None,
+                        help = 'compiled dictionary used instead of the csv '
+                               'files')
+    parser.add_argument('--port', type = int, default = PORT)
+    args = parser.parse_args()
+
+    load_service(args.drugs, args.stems, args.dictionary)
+    if args.mode == 'serve':
+        serve(args.port)
+    else:
+        answer_lines()
@@ -0,0 +1,163 @@
+import sqlite3
+import hashlib
+import json
+import time
+import sys
+
+"""
+On-disk cache for the matches of Task 1. Each entry maps an intervention_name
+to the list of matched primary drug names and is stored under a fingerprint of
+everything the matching depends on (drug dictionary, scorer and threshold), so
+the entries of an older dictionary are never returned.
+
+The entries are kept in an SQLite file. When the cache grows past
+MAX_ENTRIES, the entries of other fingerprints are evicted first, followed by
+the least recently used ones.
+
+The cache can be inspected or cleared from the terminal:
+
+    python match_cache.py info [cache_file]
+    python match_cache.py clear [cache_file]
+"""
+
+CACHE_FILE = 'match_cache.sqlite'
+MAX_ENTRIES = 1000000
+
+def get_fingerprint(*parts):
+    """
+    Hashes the json representation of a set of values.
+
+    Parameters
+    ----------
+    *parts : json serializable values (e.g. the drug names, the scorer name
+             and the threshold).
+
+    Returns
+    -------
+    str
+        sha256 hex digest.
+    """
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+def open_cache(cache_file = CACHE_FILE):
+    """
+    Opens (or creates) the cache file.
+
+    Parameters
+    ----------
+    cache_file : Path of the SQLite file.
+
+    Returns
+    -------
+    sqlite3.Connection
+        Connection to the cache.
+    """
+    connection = sqlite3.connect(cache_file)
+    connection.execute('CREATE TABLE IF NOT EXISTS matches ('
+                       'fingerprint TEXT, notes TEXT, drugs TEXT, '
+                       'last_used REAL, PRIMARY KEY (fingerprint, notes))')
+    return connection
+
+def get_matches(connection, fingerprint, strings):
+    """
+    Looks up a list of intervention_names and marks the hits as used.
+
+    Parameters
+    ----------
+    connection : Output of open_cache().
+    fingerprint : Fingerprint of the current matching setup.
+    strings : List of intervention_name strings.
+
+    Returns
+    -------
+    dict
+        Cached drug lists for the intervention_names found in the cache.
+    """
+    cached = {}
+    for start in range(0, len(strings), 500):
+        batch = strings[start:start+500]
+        rows = connection.execute(
+            'SELECT notes, drugs FROM matches WHERE fingerprint = ? AND notes '
+            'IN ({})'.format(','.join('?'*len(batch))), [fingerprint] + batch)
+        cached.update((notes, json.loads(drugs)) for notes, drugs in rows)
+    connection.executemany(
+        'UPDATE matches SET last_used = ? WHERE fingerprint = ? AND notes = ?',
+        [(time.time(), fingerprint, notes) for notes in cached])
+    connection.commit()
+    return cached
+
+def put_matches(connection, fingerprint, matches, max_entries = MAX_ENTRIES):
+    """
+    Stores new matches and evicts entries beyond max_entries.
+
+    Parameters
+    ----------
+    connection : Output of open_cache().
+    fingerprint : Fingerprint of the current matching setup.
+    matches : Dictionary mapping intervention_names to drug lists.
+    max_entries : Maximum number of entries kept in the cache.
+
+    Returns
+    -------
+    None.
+    """
+    now = time.time()
+    connection.executemany(
+        'INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?)',
+        [(fingerprint, notes, json.dumps(drugs), now)
+         for notes, drugs in matches.items()])
+    excess = connection.execute(
+        'SELECT COUNT(*) FROM matches').fetchone()[0] - max_entries
+    if excess > 0:
+        connection.execute(
+            'DELETE FROM matches WHERE rowid IN (SELECT rowid FROM matches '
+            'ORDER BY fingerprint = ?, last_used LIMIT ?)',
+            (fingerprint, excess))
+    connection.commit()
+
+def cache_info(connection):
+    """
+    Summarises the content of the cache.
+
+    Parameters
+    ----------
+    connection : Output of open_cache().
+
+    Returns
+    -------
+    dict
+        Number of entries per fingerprint.
+    """
+    return dict(connection.execute(
+        'SELECT fingerprint, COUNT(*) FROM matches GROUP BY fingerprint'))
+
+def clear_cache(connection):
+    """
+    Removes every entry from the cache.
+
+    Parameters
+    ----------
+    connection : Output of open_cache().
+
+    Returns
+    -------
+    None.
+    """
+    connection.execute('DELETE FROM matches')
+    connection.commit()
+    connection.execute('VACUUM')
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'info'
+    connection = open_cache(sys.argv[2] if len(sys.argv) > 2 else CACHE_FILE)
+    if command == 'clear':
+        clear_cache(connection)
+        print('Cache cleared')
+    elif command == 'info':
+        info = cache_info(connection)
+        print('{} entries'.format(sum(info.values())))
+        for fingerprint, count in info.items():
+            print('  {}: {} entries'.format(fingerprint, count))
+    else:
+        sys.exit('Usage: python match_cache.py [info|clear] [cache_file]')
+    connection.close()
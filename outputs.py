@@ -0,0 +1,141 @@
+import pandas as pd
+import json
+import os
+
+"""
+Helpers to save the results of the four tasks and read them back.
+
+The results can be saved in two formats, selected with OUTPUT_FORMAT:
+
+  - 'json': a json file with one dictionary per row, indented (the format of
+    the files in the Output directory).
+  - 'jsonl': a compact json lines file, with one dictionary per line and no
+    indentation. It is written by pandas straight from the columns of the
+    dataframe, which is much faster than building a dictionary per row, and
+    the files are about half the size.
+
+Both are written without building a Series per row, and read_output() reads
+either of them back into a dataframe, so the tasks that read the output of a
+previous task do not depend on the format. They find that output with 
+find_output_file(), which picks the most recently written of the two formats: 
+the streaming mode of task 1 always writes json lines, whatever OUTPUT_FORMAT 
+is, and an older .json file must not be read instead.
+"""
+
+OUTPUT_FORMAT = 'json'
+
+def get_output_file(task, output_format = None):
+    """
+    Builds the path of the output file of a task.
+
+    Parameters
+    ----------
+    task : Name of the task (e.g. 'Task_1').
+    output_format : 'json' or 'jsonl' (OUTPUT_FORMAT by default).
+
+    Returns
+    -------
+    str
+        Path of the output file.
+    """
+    return 'Output/{}_output.{}'.format(task, output_format or OUTPUT_FORMAT)
+
+def find_output_file(task):
+    """
+    Finds the most recent output file of a task, in either format.
+
+    Parameters
+    ----------
+    task : Name of the task (e.g. 'Task_1').
+
+    Returns
+    -------
+    str
+        Path of the newest existing output file, or of the file in 
+        OUTPUT_FORMAT if there is none.
+    """
+    output_files = [get_output_file(task, x) for x in ['json', 'jsonl']]
+    output_files = [x for x in output_files if os.path.exists(x)]
+    if not output_files:
+        return get_output_file(task)
+    return max(output_files, key = os.path.getmtime)
+
+def is_missing(value):
+    """Returns True if a value is None or NaN (lists are never missing)."""
+    return value is None or (isinstance(value, float) and value != value)
+
+def write_json(result, output_file):
+    """
+    Saves a result dataframe as a json file, with one dictionary per row
+    (without the missing values).
+
+    Parameters
+    ----------
+    result : Result dataframe.
+    output_file : Path of the json file.
+
+    Returns
+    -------
+    None.
+    """
+    parsed = [{key: value for key, value in row.items()
+               if not is_missing(value)}
+              for row in result.to_dict(orient = 'records')]
+
+    with open(output_file, 'w') as json_file:
+        json.dump(parsed, json_file, indent = 4)
+
+def write_jsonl(result, output_file):
+    """
+    Saves a result dataframe as a compact json lines file, with one dictionary
+    per row. An empty dataframe writes no lines (pandas would write an empty
+    line, which is not valid json lines).
+
+    Parameters
+    ----------
+    result : Result dataframe.
+    output_file : Path of the json lines file, or file opened for writing.
+
+    Returns
+    -------
+    None.
+    """
+    if len(result):
+        result.to_json(output_file, orient = 'records', lines = True,
+                       force_ascii = False)
+    elif isinstance(output_file, str):
+        open(output_file, 'w').close()
+
+def write_output(result, output_file):
+    """
+    Saves a result dataframe in the format given by the extension of the
+    output file (.json or .jsonl).
+
+    Parameters
+    ----------
+    result : Result dataframe.
+    output_file : Path of the output file.
+
+    Returns
+    -------
+    None.
+    """
+    if output_file.endswith('.jsonl'):
+        write_jsonl(result, output_file)
+    else:
+        write_json(result, output_file)
+
+def read_output(output_file):
+    """
+    Reads a result saved by write_output().
+
+    Parameters
+    ----------
+    output_file : Path of the .json or .jsonl file.
+
+    Returns
+    -------
+    Dataframe
+        Result dataframe.
+    """
+    return pd.read_json(output_file, lines = output_file.endswith('.jsonl'))
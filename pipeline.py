@@ -0,0 +1,210 @@
+import pandas as pd
+import argparse
+import hashlib
+import os
+import pickle
+import time
+
+import Task_1_completed
+import Task_2_completed
+import Task_3_completed
+import Task_4_completed
+import outputs
+from instrumentation import measure, write_metrics
+
+"""
+This script runs the four tasks as a single pipeline. Instead of writing the
+output of every task to the Output directory and reading it back, the
+dataframes are passed in memory from one task to the next.
+
+Each stage declares the input files it reads, the stages it depends on and the
+source files its code lives in. Its result is cached (pickled) under a key
+made of the hashes of all of them, and the keys of the stages it depends on.
+When the pipeline is run again, only the stages whose key changed are run
+again, e.g. a new usan_stems.csv reruns tasks 2, 3 and 4, but not task 1.
+Cached results are only loaded when they are needed by a stage that has to
+run (or to be written).
+
+The steps of every stage that runs are measured (see instrumentation.py) and
+saved in Output/pipeline_metrics.json, with the counters of all stages.
+
+Writing the files of the Output directory is optional, as json (the default) 
+or compact json lines files (see outputs.py):
+
+    python pipeline.py [task_1 task_2 task_3 task_4] [--write-outputs]
+                       [--output-format json|jsonl] [--no-cache]
+"""
+
+CACHE_DIR = '.pipeline_cache'
+METRICS_FILE = 'Output/pipeline_metrics.json'
+
+def run_task_1(drugs_file, trials_file):
+    """Runs task 1 on the drugs and clinical trials files."""
+    with measure('task_1', 'load'):
+        drugs = pd.read_csv(drugs_file)
+        clinical_trials = pd.read_json(trials_file, lines = True)
+    return Task_1_completed.match_trials(drugs, clinical_trials)
+
+def run_task_2(drugs_file, stems_file):
+    """Runs task 2 on the drugs and usan stems files."""
+    with measure('task_2', 'load'):
+        drugs = pd.read_csv(drugs_file)
+        usan_stem = Task_2_completed.read_usan_stems(stems_file)
+    return Task_2_completed.classify_drugs(drugs, usan_stem)
+
+def run_task_3(task_1, task_2):
+    """Runs task 3 on the results of tasks 1 and 2."""
+    return Task_3_completed.group_trials(task_1, task_2)
+
+def run_task_4(task_3):
+    """Runs task 4 on the result of task 3."""
+    return Task_4_completed.count_pairs(task_3)
+
+# name: (input files, dependencies, source files, function, output name)
+STAGES = {
+    'task_1': (['drugs.csv', 'clinical_trials_2015.jsonl'], [],
+               ['Task_1_completed.py', 'aho_corasick.py', 'match_cache.py',
+                'tfidf_matcher.py', 'instrumentation.py'],
+               run_task_1, 'Task_1'),
+    'task_2': (['drugs.csv', 'usan_stems.csv'], [],
+               ['Task_2_completed.py', 'aho_corasick.py',
+                'instrumentation.py'],
+               run_task_2, 'Task_2'),
+    'task_3': ([], ['task_1', 'task_2'],
+               ['Task_3_completed.py', 'instrumentation.py'],
+               run_task_3, 'Task_3'),
+    'task_4': ([], ['task_3'], ['Task_4_completed.py', 'instrumentation.py'],
+               run_task_4, 'Task_4'),
+    }
+
+def hash_file(path):
+    """
+    Computes the sha256 hash of a file.
+
+    Parameters
+    ----------
+    path : Path of the file.
+
+    Returns
+    -------
+    str
+        Hex digest of the file content.
+    """
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def get_stage_keys(stages = STAGES):
+    """
+    Computes the cache key of every stage from its input files, source files
+    and the keys of the stages it depends on.
+
+    Parameters
+    ----------
+    stages : Dictionary describing the stages (see STAGES).
+
+    Returns
+    -------
+    keys : Dictionary with the key of every stage.
+    """
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    file_hashes = {}
+    keys = {}
+
+    def get_key(name):
+        if name not in keys:
+            files, depends, sources, function, output = stages[name]
+            hasher = hashlib.sha256(name.encode('utf-8'))
+            for path in files + [os.path.join(source_dir, x) for x in sources]:
+                if path not in file_hashes:
+                    file_hashes[path] = hash_file(path)
+                hasher.update(file_hashes[path].encode('utf-8'))
+            for dependency in depends:
+                hasher.update(get_key(dependency).encode('utf-8'))
+            keys[name] = hasher.hexdigest()
+        return keys[name]
+
+    for name in stages:
+        get_key(name)
+    return keys
+
+def run_pipeline(targets = None, write_outputs = False, use_cache = True,
+                 stages = STAGES, cache_dir = CACHE_DIR):
+    """
+    Runs the stages needed to get the target results, reusing the cached
+    results of the stages whose inputs have not changed.
+
+    Parameters
+    ----------
+    targets : List of stage names (all stages by default).
+    write_outputs : If True, the output file of every target is written (in
+                    the format set by outputs.OUTPUT_FORMAT).
+    use_cache : If False, every stage needed is run and nothing is cached.
+    stages : Dictionary describing the stages (see STAGES).
+    cache_dir : Directory where the stage results are pickled.
+
+    Returns
+    -------
+    results : Dictionary with the result dataframe of every target.
+    """
+    targets = list(stages) if targets is None else targets
+    keys = get_stage_keys(stages)
+    results = {}
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def get_result(name):
+        if name in results:
+            return results[name]
+        files, depends, sources, function, output = stages[name]
+        cache_file = os.path.join(cache_dir, '{}.{}.pkl'.format(name,
+                                                                keys[name]))
+        if use_cache and os.path.exists(cache_file):
+            with open(cache_file, 'rb') as file:
+                results[name] = pickle.load(file)
+            print('{}: cached'.format(name))
+            return results[name]
+
+        inputs = files + [get_result(x) for x in depends]
+        start_time = time.time()
+        results[name] = function(*inputs)
+        print('{}: ran in {:.2f} seconds'.format(name,
+                                                 time.time() - start_time))
+        if use_cache:
+            for old_file in os.listdir(cache_dir):
+                if old_file.startswith(name + '.'):
+                    os.remove(os.path.join(cache_dir, old_file))
+            with open(cache_file, 'wb') as file:
+                pickle.dump(results[name], file)
+        return results[name]
+
+    for name in targets:
+        get_result(name)
+        if write_outputs:
+            with measure(name, 'serialize'):
+                outputs.write_output(results[name], 
+                                     outputs.get_output_file(stages[name][4]))
+    return {name: results[name] for name in targets}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Runs the four tasks as a single pipeline.')
+    parser.add_argument('targets', nargs = '*',
+                        help = 'stages to run (all by default): {}'.format(
+                            ', '.join(STAGES)))
+    parser.add_argument('--write-outputs', action = 'store_true',
+                        help = 'write the files of the Output directory')
+    parser.add_argument('--output-format', choices = ['json', 'jsonl'],
+                        default = outputs.OUTPUT_FORMAT,
+                        help = 'format of the files of the Output directory')
+    parser.add_argument('--no-cache', action = 'store_true',
+                        help = 'run every stage and do not cache the results')
+    args = parser.parse_args()
+    outputs.OUTPUT_FORMAT = args.output_format
+    for name in args.targets:
+        if name not in STAGES:
+            parser.error('unknown stage: {}'.format(name))
+    run_pipeline(args.targets or None, args.write_outputs, not args.no_cache)
+    write_metrics(METRICS_FILE)
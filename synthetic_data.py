@@ -0,0 +1,294 @@
+import argparse
+import csv
+import json
+import os
+import random
+
+"""
+This script writes synthetic versions of the three input files (drugs.csv,
+clinical_trials_2015.jsonl and usan_stems.csv), so that the tasks can be run
+and benchmarked without the original data, at any scale.
+
+The usan stems are random prefixes ('xxx-'), suffixes ('-xxx') and infixes
+('-xxx-') grouped in classes and subclasses, with the group rows (no stem) the
+real file uses to separate them. Drug names are built from these stems, and
+some of them get a salt or ester as a second word (sometimes two, e.g. 
+'sodium succinate'), a prefix such as 'recombinant human' or a number, like 
+the real drug names. These long, multi-word names are the ones whose typos 
+can still reach the QRatio threshold of task 1, so they exercise its fuzzy 
+matching path (a one character typo can only match a name of more than 20 
+characters). Every drug has a few alternate names: brand names (some of them with
+the ® or ™ marks), codes and synonyms.
+
+The intervention_names of the clinical trials mention one or two drugs, by
+their primary or alternate names, with doses, formulations, typos and ® marks
+mixed in, or no drug at all (placebo, procedures...). Several rows share the
+same nct_id, and some intervention_names are repeated.
+
+At scale 1, the files have DRUGS drugs, TRIALS clinical trial rows and STEMS
+stems. All of them are multiplied by the scale.
+
+    python synthetic_data.py [--scale 1] [--seed 0] [--output-dir .]
+"""
+
+DRUGS = 2000
+TRIALS = 10000
+STEMS = 300
+
+CONSONANTS = 'bcdfglmnprstvxz'
+VOWELS = 'aeiou'
+SALTS = ['sodium', 'hydrochloride', 'acetate', 'sulfate', 'potassium',
+         'mesylate', 'citrate', 'maleate', 'dipropionate', 'hydrobromide',
+         'phosphate', 'succinate', 'monohydrate', 'fumarate', 'besylate']
+PREFIXES = ['recombinant human', 'recombinant', 'pegylated', 'liposomal',
+            'human']
+FORMS = ['tablets', 'injection', 'oral solution', 'infusion', 'capsules',
+         'IV', 'cream', 'extended release']
+OTHER_INTERVENTIONS = ['Placebo', 'placebo tablets', 'Saline', 'Standard of care',
+                       'Surgery', 'Exercise program', 'Counselling',
+                       'Vitamin supplement']
+
+def get_syllables(rng, count):
+    """
+    Builds a pronounceable string.
+
+    Parameters
+    ----------
+    rng : random.Random instance.
+    count : Number of consonant-vowel syllables.
+
+    Returns
+    -------
+    str
+        Random string.
+    """
+    return ''.join(rng.choice(CONSONANTS) + rng.choice(VOWELS)
+                   for i in range(count))
+
+def add_typo(rng, string):
+    """
+    Deletes, duplicates, replaces or swaps one character of a string.
+
+    Parameters
+    ----------
+    rng : random.Random instance.
+    string : Input string.
+
+    Returns
+    -------
+    str
+        String with a typo.
+    """
+    if len(string) < 4:
+        return string
+    i = rng.randrange(1, len(string) - 2)
+    typo = rng.randrange(4)
+    if typo == 0:
+        return string[:i] + string[i+1:]
+    if typo == 1:
+        return string[:i] + string[i] + string[i:]
+    if typo == 2:
+        return string[:i] + rng.choice(VOWELS) + string[i+1:]
+    return string[:i] + string[i+1] + string[i] + string[i+2:]
+
+def make_stems(rng, count):
+    """
+    Builds the rows of the usan_stems file.
+
+    Parameters
+    ----------
+    rng : random.Random instance.
+    count : Approximate number of stem rows.
+
+    Returns
+    -------
+    rows : List of [name, stem, definition, examples] rows.
+    elements : List of the stem elements, used to build the drug names.
+    """
+    rows = []
+    elements = []
+    cores = set()
+    group = 0
+    while len(elements) < count:
+        group += 1
+        rows.append(['group {}'.format(group), '', 'group {}'.format(group), ''])
+        for subclass in range(rng.randint(1, 4)):
+            stem = []
+            for i in range(rng.randint(1, 2)):
+                core = get_syllables(rng, rng.randint(1, 2)) + rng.choice(
+                    CONSONANTS)
+                if core in cores:
+                    continue
+                cores.add(core)
+                stem.append(rng.choice(['-' + core] * 6 + [core + '-'] * 3 +
+                                       ['-' + core + '-']))
+            if not stem:
+                continue
+            elements.extend(stem)
+            name = stem[0] if subclass == 0 else ''
+            description = '{} derivatives ({})'.format(
+                get_syllables(rng, 3), 'group {}'.format(group) if subclass == 0
+                else 'subclass {}'.format(subclass))
+            rows.append([name, ', '.join(stem), description,
+                         'example' + get_syllables(rng, 2)])
+    return rows, elements
+
+def make_drugs(rng, count, elements):
+    """
+    Builds the rows of the drugs file from the stem elements.
+
+    Parameters
+    ----------
+    rng : random.Random instance.
+    count : Number of drugs.
+    elements : Stem elements, as returned by make_stems().
+
+    Returns
+    -------
+    rows : List of [itemLabel, altLabel] rows.
+    """
+    rows = []
+    names = set()
+    while len(rows) < count:
+        element = rng.choice(elements)
+        core = element.strip('-')
+        if element.endswith('-') and not element.startswith('-'):
+            name = core + get_syllables(rng, rng.randint(1, 3))
+        elif element.startswith('-') and element.endswith('-'):
+            name = get_syllables(rng, rng.randint(1, 2)) + core + \
+                get_syllables(rng, 1)
+        else:
+            name = get_syllables(rng, rng.randint(1, 3)) + core
+        if name in names:
+            continue
+        names.add(name)
+        label = name
+        kind = rng.random()
+        if kind < 0.25:
+            label = '{} {}'.format(name, rng.choice(SALTS))
+        elif kind < 0.4:
+            label = '{} {} {}'.format(name, *rng.sample(SALTS, 2))
+        elif kind < 0.5:
+            label = '{} {}'.format(rng.choice(PREFIXES), name)
+        elif kind < 0.54:
+            label = '{}-{}'.format(rng.randint(2, 9), name)
+
+        alternates = [name.upper()] if label != name else []
+        for i in range(rng.randint(1, 3)):
+            brand = get_syllables(rng, rng.randint(2, 3)).capitalize()
+            alternates.append(brand + rng.choice(['', '', '®', '™']))
+        if rng.random() < 0.3:
+            alternates.append('{}-{}'.format(
+                ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+                        for i in range(2)), rng.randint(100, 9999)))
+        rows.append([label, '|'.join(alternates)])
+    return rows
+
+def make_trials(rng, count, drugs):
+    """
+    Builds the clinical trial records.
+
+    Parameters
+    ----------
+    rng : random.Random instance.
+    count : Number of records.
+    drugs : Rows of the drugs file, as returned by make_drugs().
+
+    Returns
+    -------
+    records : List of dictionaries with the nct_id, intervention_type and
+              intervention_name of every record.
+    """
+    records = []
+    nct_id = 1000000
+    previous = []
+    while len(records) < count:
+        nct_id += rng.randint(1, 50)
+        for arm in range(rng.choice([1, 1, 1, 2, 2, 3])):
+            if previous and rng.random() < 0.1:
+                records.append({'nct_id': 'NCT{:08d}'.format(nct_id),
+                                'intervention_type': 'Drug',
+                                'intervention_name': rng.choice(previous)})
+                continue
+            if rng.random() < 0.25:
+                records.append({
+                    'nct_id': 'NCT{:08d}'.format(nct_id),
+                    'intervention_type': rng.choice(
+                        ['Drug', 'Device', 'Procedure', 'Behavioral',
+                         'Dietary Supplement']),
+                    'intervention_name': rng.choice(OTHER_INTERVENTIONS)})
+                continue
+
+            mentions = []
+            for i in range(rng.choice([1, 1, 1, 2])):
+                label, alternates = rng.choice(drugs)
+                name = rng.choice([label] * 3 + alternates.split('|'))
+                if rng.random() < 0.1:
+                    name = add_typo(rng, name)
+                if rng.random() < 0.2:
+                    name = name.capitalize()
+                if rng.random() < 0.05:
+                    name = name + '®'
+                mentions.append(name)
+            notes = ' and '.join(mentions)
+            if rng.random() < 0.4:
+                notes = '{} {} mg'.format(notes, rng.choice([5, 10, 50, 100]))
+            if rng.random() < 0.3:
+                notes = '{} {}'.format(notes, rng.choice(FORMS))
+            if rng.random() < 0.1:
+                notes = '{} ({})'.format(notes, rng.choice(
+                    ['high dose', 'low dose', 'arm A', 'arm B']))
+            previous.append(notes)
+            records.append({
+                'nct_id': 'NCT{:08d}'.format(nct_id),
+                'intervention_type': rng.choice(['Drug'] * 9 + ['Biological']),
+                'intervention_name': notes})
+    return records[:count]
+
+def write_synthetic_data(output_dir = '.', scale = 1, seed = 0):
+    """
+    Writes the three synthetic input files.
+
+    Parameters
+    ----------
+    output_dir : Directory where the files are written.
+    scale : Multiplier of the number of drugs, clinical trials and stems.
+    seed : Seed of the random generator.
+
+    Returns
+    -------
+    None.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok = True)
+    stems, elements = make_stems(rng, int(STEMS*scale))
+    drugs = make_drugs(rng, int(DRUGS*scale), elements)
+    trials = make_trials(rng, int(TRIALS*scale), drugs)
+
+    with open(os.path.join(output_dir, 'usan_stems.csv'), 'w',
+              newline = '') as file:
+        writer = csv.writer(file, quoting = csv.QUOTE_ALL)
+        writer.writerow(['name', 'stem', 'definition', 'examples'])
+        writer.writerows(stems)
+
+    with open(os.path.join(output_dir, 'drugs.csv'), 'w', newline = '',
+              encoding = 'utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['itemLabel', 'altLabel'])
+        writer.writerows(drugs)
+
+    with open(os.path.join(output_dir, 'clinical_trials_2015.jsonl'),
+              'w') as file:
+        for record in trials:
+            json.dump(record, file)
+            file.write('\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Writes synthetic input files for the four tasks.')
+    parser.add_argument('--scale', type = float, default = 1,
+                        help = 'multiplier of the number of records')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output-dir', default = '.')
+    args = parser.parse_args()
+    write_synthetic_data(args.output_dir, args.scale, args.seed)
@@ -0,0 +1,34 @@
+import pandas as pd
+
+import incremental_update
+from outputs import read_output
+
+TASK_2 = pd.DataFrame({
+    'drug': ['labetalol', 'magnesium sulfate'],
+    'usan_codes': [
+        [{'description': 'combined alpha and beta blockers', 'type': 'class'}],
+        [{'description': 'quaternary ammonium derivatives', 'type': 'class'}]]})
+
+def test_empty_task_1(tmp_path):
+    output_file = tmp_path / 'Task_1_output.json'
+    output_file.write_text('[]')
+    connection = incremental_update.open_state(str(tmp_path / 'state.sqlite'))
+    incremental_update.build_state(connection, read_output(str(output_file)),
+                                   TASK_2)
+    assert incremental_update.get_task_3(connection)['trials'].tolist() == \
+        [[], []]
+    assert len(incremental_update.get_task_4(connection)) == 0
+    assert incremental_update.verify_state(connection, TASK_2) == (True, True)
+
+def test_delta_matches_full_recompute(tmp_path):
+    connection = incremental_update.open_state(str(tmp_path / 'state.sqlite'))
+    incremental_update.build_state(connection, pd.DataFrame({
+        'nct_id': ['NCT1', 'NCT2'],
+        'drugs': [['labetalol'], ['labetalol']]}), TASK_2)
+    incremental_update.apply_delta(
+        connection,
+        pd.DataFrame({'nct_id': ['NCT1'], 'drugs': [['magnesium sulfate']]}),
+        pd.DataFrame({'nct_id': ['NCT2'], 'drugs': [['labetalol']]}))
+    assert incremental_update.get_task_4(connection)['trial_count'].tolist() \
+        == [1]
+    assert incremental_update.verify_state(connection, TASK_2) == (True, True)
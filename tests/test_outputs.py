@@ -0,0 +1,25 @@
+import os
+
+import pandas as pd
+
+import outputs
+
+def test_find_output_file_picks_the_newest_format(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.mkdir('Output')
+    assert outputs.find_output_file('Task_1') == 'Output/Task_1_output.json'
+
+    result = pd.DataFrame({'nct_id': ['NCT1'], 'drugs': [['labetalol']]})
+    outputs.write_output(result, 'Output/Task_1_output.json')
+    outputs.write_output(result.iloc[:0], 'Output/Task_1_output.jsonl')
+    os.utime('Output/Task_1_output.json', (1, 1))
+    assert outputs.find_output_file('Task_1') == 'Output/Task_1_output.jsonl'
+
+    os.utime('Output/Task_1_output.jsonl', (0, 0))
+    assert outputs.find_output_file('Task_1') == 'Output/Task_1_output.json'
+
+def test_write_jsonl_empty(tmp_path):
+    output_file = str(tmp_path / 'empty.jsonl')
+    outputs.write_jsonl(pd.DataFrame(columns = ['nct_id', 'drugs']),
+                        output_file)
+    assert open(output_file).read() == ''
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+from rapidfuzz import fuzz, process, utils
+
+import Task_1_completed
+
+def find_match_baseline(drug_name, notes):
+    """find_match() of the original script, without any pruning."""
+    spaces = drug_name.count(' ')
+    length = len(drug_name)
+    if (length<=2) | (spaces>(notes.count(' '))) | (length>len(notes)):
+        return False
+    words_in_notes = Task_1_completed.get_windows(notes, spaces)
+    if not words_in_notes:
+        return False
+    best_match = process.extractOne(drug_name, words_in_notes,
+                                    scorer = fuzz.QRatio,
+                                    processor = utils.default_process)
+    return best_match[1] > 97.5
+
+def match_baseline(notes, drugs_names):
+    return [names[0] for names in drugs_names
+            if any(find_match_baseline(x, notes) for x in names)]
+
+def random_word(rng, length):
+    return ''.join(rng.choice('abcdeilmnorstu') for i in range(length))
+
+def random_name(rng):
+    kind = rng.random()
+    if kind < 0.4:
+        # single words at the edge of the fuzzy-match cutoff: a one character
+        # typo only matches names longer than 20 processed characters
+        return random_word(rng, rng.choice([19, 20, 21, 22]))
+    if kind < 0.7:
+        return random_word(rng, rng.randint(3, 12))
+    return ' '.join(random_word(rng, rng.randint(3, 11))
+                    for i in range(rng.randint(2, 3)))
+
+def add_typo(rng, name):
+    i = rng.randrange(len(name))
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:i] + name[i+1:]
+    if kind == 1:
+        return name[:i] + rng.choice('aeiou') + name[i+1:]
+    if kind == 2:
+        return name[:i] + rng.choice('aeiou') + name[i:]
+    return name.upper() if rng.random() < 0.5 else name + '-'
+
+def random_notes(rng, drugs_names):
+    parts = []
+    for i in range(rng.randint(1, 3)):
+        kind = rng.random()
+        name = rng.choice(rng.choice(drugs_names))
+        if kind < 0.4:
+            parts.append(name)
+        elif kind < 0.8:
+            parts.append(add_typo(rng, name))
+        else:
+            parts.append(random_word(rng, rng.randint(2, 9)))
+    separators = [' ', ' ', ' ', '  ', '\t', ' \t ', ' (', ') ']
+    notes = parts[0]
+    for part in parts[1:]:
+        notes += rng.choice(separators) + part
+    return notes
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('char_pruning', [False, True])
+def test_matchers_agree_with_baseline(seed, char_pruning, monkeypatch):
+    monkeypatch.setattr(Task_1_completed, 'CHAR_PRUNING', char_pruning)
+    rng = random.Random(seed)
+    drugs_names = [[random_name(rng) for j in range(rng.randint(1, 3))]
+                   for i in range(40)]
+    interventions = [random_notes(rng, drugs_names) for i in range(150)]
+    expected = [match_baseline(x, drugs_names) for x in interventions]
+
+    indexes = Task_1_completed.build_indexes(drugs_names)
+    assert [Task_1_completed.match_notes(x, indexes)
+            for x in interventions] == expected
+    assert Task_1_completed.match_batch(interventions,
+                                        drugs_names) == expected
@@ -0,0 +1,31 @@
+import pandas as pd
+import pytest
+
+import Task_3_completed
+from outputs import read_output
+
+TASK_2 = pd.DataFrame({
+    'drug': ['labetalol', 'magnesium sulfate'],
+    'usan_codes': [
+        [{'description': 'combined alpha and beta blockers', 'type': 'class'}],
+        [{'description': 'quaternary ammonium derivatives', 'type': 'class'},
+         {'description': 'sulfonamides', 'type': 'subclass'}]]})
+
+@pytest.mark.parametrize('file_name, content', [('Task_1_output.json', '[]'),
+                                                ('Task_1_output.jsonl', '')])
+def test_group_trials_without_matches(tmp_path, file_name, content):
+    output_file = tmp_path / file_name
+    output_file.write_text(content)
+    result = Task_3_completed.group_trials(read_output(str(output_file)),
+                                           TASK_2)
+    assert result['description'].tolist() == [
+        'combined alpha and beta blockers', 'quaternary ammonium derivatives',
+        'sulfonamides']
+    assert result['trials'].tolist() == [[], [], []]
+
+def test_group_trials():
+    task_1 = pd.DataFrame({'nct_id': ['NCT1', 'NCT1', 'NCT2'],
+                           'drugs': [['labetalol'], ['magnesium sulfate'],
+                                     ['labetalol', 'unclassified']]})
+    result = Task_3_completed.group_trials(task_1, TASK_2)
+    assert result['trials'].tolist() == [['NCT1', 'NCT2'], ['NCT1'], ['NCT1']]
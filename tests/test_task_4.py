@@ -0,0 +1,41 @@
+import itertools
+import random
+
+import numpy as np
+from scipy import sparse
+
+import Task_4_completed
+
+def brute_force_itemsets(trial_classes, num_of_classes, min_support, max_size):
+    itemsets = {}
+    for size in range(1, (max_size or num_of_classes) + 1):
+        for itemset in itertools.combinations(range(num_of_classes), size):
+            support = sum(set(itemset) <= x for x in trial_classes)
+            if support >= min_support:
+                itemsets[itemset] = support
+    return itemsets
+
+def test_mine_itemsets_matches_brute_force():
+    rng = random.Random(0)
+    for case in range(30):
+        num_of_classes = rng.randint(1, 8)
+        trial_classes = [set(rng.sample(range(num_of_classes),
+                                        rng.randint(1, num_of_classes)))
+                         for i in range(rng.randint(1, 40))]
+        trial_ids, class_ids = zip(*[(i, j) for i, x in enumerate(trial_classes)
+                                     for j in x])
+        incidence = sparse.csc_matrix(
+            (np.ones(len(trial_ids), dtype = np.int64), (trial_ids, class_ids)),
+            shape = (len(trial_classes), num_of_classes))
+        incidence.sort_indices()
+        trial_lists = [incidence.indices[incidence.indptr[i]:
+                                         incidence.indptr[i+1]]
+                       for i in range(num_of_classes)]
+        min_support = rng.randint(1, 5)
+        max_size = rng.choice([None, 2, 3])
+
+        itemsets = Task_4_completed.mine_itemsets(
+            trial_lists, incidence.T @ incidence, min_support, max_size)
+        assert {tuple(x): support for x, support in itemsets} == \
+            brute_force_itemsets(trial_classes, num_of_classes, min_support,
+                                 max_size)
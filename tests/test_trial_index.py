@@ -0,0 +1,33 @@
+import pandas as pd
+
+import trial_index
+from outputs import write_output
+
+def write_task_3(path, trials):
+    write_output(pd.DataFrame({'description': ['class a'], 'type': ['class'],
+                               'trials': [trials]}), str(path))
+
+def test_open_index_rebuilds_stale_index(tmp_path):
+    source_file = tmp_path / 'Task_3_output.json'
+    index_file = str(tmp_path / 'trial_index.npz')
+    write_task_3(source_file, ['NCT1'])
+    index = trial_index.open_index(str(source_file), index_file)
+    assert index[2].tolist() == ['NCT1']
+
+    write_task_3(source_file, ['NCT1', 'NCT2'])
+    index = trial_index.open_index(str(source_file), index_file)
+    assert index[2].tolist() == ['NCT1', 'NCT2']
+    assert (trial_index.get_index_source(index_file) ==
+            trial_index.hash_file(str(source_file)))
+
+def test_open_index_reuses_current_index(tmp_path, monkeypatch):
+    source_file = tmp_path / 'Task_3_output.json'
+    index_file = str(tmp_path / 'trial_index.npz')
+    write_task_3(source_file, ['NCT1'])
+    trial_index.open_index(str(source_file), index_file)
+
+    def fail(task_3):
+        raise AssertionError('index built again')
+    monkeypatch.setattr(trial_index, 'build_trial_index', fail)
+    assert trial_index.open_index(str(source_file), index_file)[2].tolist() \
+        == ['NCT1']
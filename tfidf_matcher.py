@@ -0,0 +1,158 @@
+import numpy as np
+
+from scipy import sparse
+
+"""
+Character n-gram TF-IDF vectors, used by the 'tfidf' matching mode of Task 1.
+
+Every string is split into its overlapping character n-grams (with a space
+added at both ends, so the n-grams at the start and end of the words are
+kept). The n-grams of the drug names define the vocabulary, weighted by their
+inverse document frequency: n-grams shared by many names (e.g. 'ine') count
+less than rare ones. Each string becomes a sparse row of n-gram counts times
+their idf, normalized to unit length, so the product of two rows is the
+cosine similarity of the strings. Multiplying the matrix of the
+intervention_names by the transposed matrix of the names scores every
+intervention_name against every name at once, and only the top scores of
+every row are kept.
+"""
+
+NGRAM_SIZE = 3
+
+def get_ngrams(string, size = NGRAM_SIZE):
+    """
+    Returns the list of character n-grams of a string (padded with spaces).
+
+    Parameters
+    ----------
+    string : Input string (already processed).
+    size : Length of the n-grams.
+
+    Returns
+    -------
+    list
+        n-grams, with repetitions.
+    """
+    string = ' {} '.format(string)
+    return [string[i:i+size] for i in range(len(string) - size + 1)]
+
+def count_ngrams(strings, vocabulary, size = NGRAM_SIZE, grow = False):
+    """
+    Builds the sparse matrix of n-gram counts of a list of strings.
+
+    Parameters
+    ----------
+    strings : List of processed strings.
+    vocabulary : Dictionary mapping each n-gram to its column.
+    size : Length of the n-grams.
+    grow : If True, unknown n-grams are added to the vocabulary, otherwise
+           they are ignored.
+
+    Returns
+    -------
+    csr_matrix
+        Matrix with one row per string and one column per n-gram.
+    """
+    rows = []
+    columns = []
+    for row, string in enumerate(strings):
+        for ngram in get_ngrams(string, size):
+            column = vocabulary.get(ngram)
+            if column is None:
+                if not grow:
+                    continue
+                column = vocabulary[ngram] = len(vocabulary)
+            rows.append(row)
+            columns.append(column)
+    counts = sparse.csr_matrix(
+        (np.ones(len(rows), dtype = np.float64), (rows, columns)),
+        shape = (len(strings), len(vocabulary)))
+    counts.sum_duplicates()
+    return counts
+
+def normalize_rows(matrix):
+    """
+    Scales the rows of a sparse matrix to unit length.
+
+    Parameters
+    ----------
+    matrix : csr_matrix.
+
+    Returns
+    -------
+    csr_matrix
+        Normalized matrix (empty rows are left empty).
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis = 1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+def build_tfidf(names, size = NGRAM_SIZE):
+    """
+    Builds the vocabulary, idf weights and TF-IDF matrix of a list of names.
+
+    Parameters
+    ----------
+    names : List of processed names.
+    size : Length of the n-grams.
+
+    Returns
+    -------
+    tfidf : Tuple with the vocabulary, the idf of every column and the
+            normalized TF-IDF matrix of the names (one row per name).
+    """
+    vocabulary = {}
+    counts = count_ngrams(names, vocabulary, size, grow = True)
+    document_frequency = np.bincount(counts.indices,
+                                     minlength = len(vocabulary))
+    idf = np.log((1 + len(names)) / (1 + document_frequency)) + 1
+    return vocabulary, idf, normalize_rows(counts @ sparse.diags(idf))
+
+def vectorize(strings, tfidf, size = NGRAM_SIZE):
+    """
+    Builds the normalized TF-IDF matrix of a list of strings with the
+    vocabulary and idf of build_tfidf().
+
+    Parameters
+    ----------
+    strings : List of processed strings.
+    tfidf : Output of build_tfidf().
+    size : Length of the n-grams.
+
+    Returns
+    -------
+    csr_matrix
+        One row per string.
+    """
+    vocabulary, idf, matrix = tfidf
+    counts = count_ngrams(strings, vocabulary, size)
+    return normalize_rows(counts @ sparse.diags(idf))
+
+def top_k(scores, k, min_score = 0):
+    """
+    Finds the k highest scores of every row of a sparse score matrix.
+
+    Parameters
+    ----------
+    scores : csr_matrix of scores.
+    k : Number of columns kept per row.
+    min_score : Scores below it are dropped.
+
+    Returns
+    -------
+    list
+        List with the (column, score) tuples of every row, highest first.
+    """
+    scores = scores.tocsr()
+    result = []
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row+1]
+        data = scores.data[start:end]
+        columns = scores.indices[start:end]
+        if len(data) > k:
+            best = np.argpartition(-data, k - 1)[:k]
+            data, columns = data[best], columns[best]
+        order = np.argsort(-data, kind = 'stable')
+        result.append([(columns[i], data[i]) for i in order
+                       if data[i] >= min_score])
+    return result
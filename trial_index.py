@@ -0,0 +1,303 @@
+import pandas as pd
+import numpy as np
+import argparse
+import hashlib
+import os
+
+from outputs import find_output_file, read_output
+from instrumentation import counters
+
+"""
+Index of the trials of every usan code of the task 3 output, to answer
+questions such as "trials using class A and class B but not C" without
+rescanning the trials lists.
+
+The nct_ids are mapped to integer ids in sorted order, so the trials of each
+row of the task 3 output become a sorted, deduplicated posting list, stored
+as a bitmap: a Python integer whose bit i is set if trial i is in the list.
+Intersection, union and difference are then single &, | and & ~ operations
+on the integers (done in C a machine word at a time), and counting the trials
+of a result is int.bit_count().
+
+On disk, the posting lists are delta encoded (the gaps between consecutive
+trial ids, which are small numbers) and saved as a compressed numpy file, so
+the index can be built once and loaded by other scripts. The file also keeps
+the hash of the task 3 output it was built from, and the command line rebuilds
+it when that output changed (or when --rebuild is given):
+
+    python trial_index.py "class A" "class B" [--any "class C" ...]
+                          [--none "class D" ...] [--index trial_index.npz]
+                          [--rebuild]
+
+Task 4's pair counts can be derived from the bitmaps too (count_pairs()).
+"""
+
+INDEX_FILE = 'trial_index.npz'
+
+def to_bitmap(trial_ids, num_of_trials):
+    """
+    Converts a list of trial ids into a bitmap.
+
+    Parameters
+    ----------
+    trial_ids : Array of trial ids (repeated ids are ignored).
+    num_of_trials : Total number of trials.
+
+    Returns
+    -------
+    int
+        Bitmap with the bit of every trial id set.
+    """
+    bits = np.zeros(num_of_trials, dtype = bool)
+    bits[trial_ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder = 'little').tobytes(),
+                          'little')
+
+def from_bitmap(bitmap, num_of_trials):
+    """
+    Converts a bitmap into the sorted array of its trial ids.
+
+    Parameters
+    ----------
+    bitmap : Bitmap, as built by to_bitmap().
+    num_of_trials : Total number of trials.
+
+    Returns
+    -------
+    Array
+        Sorted trial ids.
+    """
+    packed = np.frombuffer(bitmap.to_bytes((num_of_trials + 7) // 8,
+                                           'little'), dtype = np.uint8)
+    bits = np.unpackbits(packed, bitorder = 'little')[:num_of_trials]
+    return np.flatnonzero(bits)
+
+def build_trial_index(task_3):
+    """
+    Builds the index from the output of task 3.
+
+    Parameters
+    ----------
+    task_3 : Dataframe with the description, type and list of trials of
+             every usan code.
+
+    Returns
+    -------
+    index : Tuple with the descriptions and types of the rows, the sorted
+            array of nct_ids (positioned by trial id) and the bitmap of every
+            row.
+    """
+    all_trials = task_3.iloc[:,2].values.tolist()
+    trials, trial_ids = np.unique(np.array([j for i in all_trials for j in i],
+                                           dtype = object),
+                                  return_inverse = True)
+    ends = np.cumsum(list(map(len, all_trials)))
+    bitmaps = [to_bitmap(x, len(trials))
+               for x in np.split(trial_ids, ends[:-1])]
+    counters['indexed trials'] += len(trials)
+    return (task_3.iloc[:,0].tolist(), task_3.iloc[:,1].tolist(), trials,
+            bitmaps)
+
+def hash_file(path):
+    """Returns the sha256 hex digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def save_index(index, index_file = INDEX_FILE, source = ''):
+    """
+    Saves the index with delta encoded posting lists.
+
+    Parameters
+    ----------
+    index : Output of build_trial_index().
+    index_file : Path of the compressed numpy file.
+    source : Hash of the task 3 output the index was built from.
+
+    Returns
+    -------
+    None.
+    """
+    descriptions, types, trials, bitmaps = index
+    postings = [from_bitmap(x, len(trials)) for x in bitmaps]
+    gaps = [np.diff(x, prepend = 0) for x in postings]
+    np.savez_compressed(
+        index_file, source = np.array(source),
+        descriptions = np.array(descriptions, dtype = str),
+        types = np.array(types, dtype = str),
+        trials = np.array(trials, dtype = str),
+        lengths = np.array(list(map(len, postings)), dtype = np.int64),
+        gaps = np.concatenate(gaps + [np.zeros(0, dtype = np.int64)]
+                              ).astype(np.uint32))
+
+def load_index(index_file = INDEX_FILE):
+    """
+    Loads an index saved by save_index().
+
+    Parameters
+    ----------
+    index_file : Path of the compressed numpy file.
+
+    Returns
+    -------
+    index : Same tuple as build_trial_index().
+    """
+    with np.load(index_file) as data:
+        trials = data['trials'].astype(object)
+        gaps = np.split(data['gaps'].astype(np.int64),
+                        np.cumsum(data['lengths'])[:-1])
+        bitmaps = [to_bitmap(np.cumsum(x), len(trials)) for x in gaps]
+        return (data['descriptions'].tolist(), data['types'].tolist(),
+                trials, bitmaps)
+
+def get_index_source(index_file = INDEX_FILE):
+    """
+    Reads the hash of the task 3 output an index was built from.
+
+    Parameters
+    ----------
+    index_file : Path of the compressed numpy file.
+
+    Returns
+    -------
+    str
+        Hash given to save_index() (empty for the files saved without one).
+    """
+    with np.load(index_file) as data:
+        return str(data['source']) if 'source' in data else ''
+
+def open_index(source_file, index_file = INDEX_FILE, rebuild = False):
+    """
+    Loads the index of a task 3 output, building (and saving) it again if the
+    index file is missing, was built from a different output or rebuild is 
+    True.
+
+    Parameters
+    ----------
+    source_file : Path of the task 3 output.
+    index_file : Path of the compressed numpy file.
+    rebuild : If True, the index is always built again.
+
+    Returns
+    -------
+    index : Same tuple as build_trial_index().
+    """
+    source = hash_file(source_file)
+    if (not rebuild and os.path.exists(index_file) and 
+            get_index_source(index_file) == source):
+        return load_index(index_file)
+    index = build_trial_index(read_output(source_file))
+    save_index(index, index_file, source)
+    return index
+
+def get_bitmap(index, description):
+    """
+    Gets the bitmap of the trials of a description (of any type).
+
+    Parameters
+    ----------
+    index : Output of build_trial_index().
+    description : Description of a usan code.
+
+    Returns
+    -------
+    int
+        Bitmap of the trials.
+    """
+    descriptions, types, trials, bitmaps = index
+    if description not in descriptions:
+        raise KeyError('unknown description: {}'.format(description))
+    bitmap = 0
+    for row, x in enumerate(descriptions):
+        if x == description:
+            bitmap |= bitmaps[row]
+    return bitmap
+
+def query_trials(index, all_of = (), any_of = (), none_of = ()):
+    """
+    Finds the trials using all the descriptions of all_of, at least one of
+    any_of (if given) and none of none_of.
+
+    Parameters
+    ----------
+    index : Output of build_trial_index().
+    all_of : Descriptions every trial must have.
+    any_of : Descriptions of which every trial must have at least one.
+    none_of : Descriptions no trial can have.
+
+    Returns
+    -------
+    list
+        Sorted nct_ids of the trials.
+    """
+    descriptions, types, trials, bitmaps = index
+    result = (1 << len(trials)) - 1
+    for description in all_of:
+        result &= get_bitmap(index, description)
+    if any_of:
+        union = 0
+        for description in any_of:
+            union |= get_bitmap(index, description)
+        result &= union
+    for description in none_of:
+        result &= ~get_bitmap(index, description)
+    return trials[from_bitmap(result, len(trials))].tolist()
+
+def count_pairs(index):
+    """
+    Counts the trials of every pair of drug classes, with the same result as
+    Task_4_completed.count_pairs() on the same task 3 output.
+
+    Parameters
+    ----------
+    index : Output of build_trial_index().
+
+    Returns
+    -------
+    result_df : Dataframe with the pairs of drug classes and the number of
+                trials in which both appear.
+    """
+    descriptions, types, trials, bitmaps = index
+    classes = {}
+    for row, description in enumerate(descriptions):
+        if types[row] == 'class' and bitmaps[row]:
+            classes[description] = classes.get(description, 0) | bitmaps[row]
+    classes = list(classes.items())
+
+    pairs = []
+    for i, (description_1, bitmap_1) in enumerate(classes):
+        for j in range(i + 1, len(classes)):
+            trial_count = (bitmap_1 & classes[j][1]).bit_count()
+            if trial_count:
+                pairs.append((-trial_count, i, j))
+    pairs.sort()
+    return pd.DataFrame({
+        'description_1': [classes[i][0] for count, i, j in pairs],
+        'description_2': [classes[j][0] for count, i, j in pairs],
+        'trial_count': [-count for count, i, j in pairs]},
+        columns = ['description_1', 'description_2', 'trial_count'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description = 'Finds the trials of a combination of usan codes.')
+    parser.add_argument('all_of', nargs = '*',
+                        help = 'descriptions every trial must have')
+    parser.add_argument('--any', nargs = '+', default = [],
+                        help = 'descriptions of which at least one is needed')
+    parser.add_argument('--none', nargs = '+', default = [],
+                        help = 'descriptions no trial can have')
+    parser.add_argument('--index', default = INDEX_FILE,
+                        help = 'index file (built from the task 3 output if '
+                               'it does not exist or is out of date)')
+    parser.add_argument('--rebuild', action = 'store_true',
+                        help = 'build the index again in any case')
+    args = parser.parse_args()
+
+    index = open_index(find_output_file('Task_3'), args.index, args.rebuild)
+    try:
+        for nct_id in query_trials(index, args.all_of, args.any, args.none):
+            print(nct_id)
+    except KeyError as error:
+        parser.error(error.args[0])